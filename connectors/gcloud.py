@@ -1,122 +1,1298 @@
-from google.cloud import bigquery
-from google.oauth2 import service_account
-import os
-import pandas as pd
-import pandas_gbq
-from utils import mellanni_modules as mm
-
-
-def get_credentials():
-    key_path = "credentials/gcloud.json"
-    credentials_from_file = service_account.Credentials.from_service_account_file(
-        key_path
-    )
-    return credentials_from_file
-
-
-def gcloud_connect(credentials=get_credentials()):
-    client = bigquery.Client(credentials=credentials, project=credentials.project_id)
-    return client
-
-
-def cgk_pricing():
-    with gcloud_connect() as client:
-        query = '''SELECT datetime, asin, brand, full_price, coupon, ld, final_price
-                    from `auxillary_development.price_comparison`
-                    WHERE asin = "B01M16WBW1"'''
-        prices = client.query(query).result().to_dataframe()
-    prices["datetime"] = pd.to_datetime(prices["datetime"])
-    prices["year"] = prices["datetime"].dt.year
-    prices["week"] = (prices["datetime"] + pd.DateOffset(days=1)).dt.isocalendar().week
-    prices = prices.sort_values("datetime")
-    with pd.ExcelWriter(
-        os.path.join(os.path.expanduser("~"), "temp/cgk_pricing.xlsx"),
-        engine="xlsxwriter",
-    ) as writer:
-        prices.to_excel(writer, sheet_name="cgk", index=False)
-        mm.format_header(prices, writer, "cgk")
-    return None
-
-
-def pull_raw(dataset="auxillary_development", report="dictionary", custom_query=None):
-    if not custom_query:
-        query = f"SELECT * FROM `{dataset}.{report}` LIMIT 10"
-    else:
-        query = custom_query
-    with gcloud_connect() as client:
-        data = client.query(query).result()
-        return data
-
-
-def pull_gcloud(
-    dataset="auxillary_development", report="dictionary", custom_query=None
-) -> pd.DataFrame:
-    if not custom_query:
-        query = f"SELECT * FROM `{dataset}.{report}` LIMIT 10"
-    else:
-        query = custom_query
-    with gcloud_connect() as client:
-        data = client.query(query).result().to_dataframe()
-    return data
-
-
-def get_datasets() -> list:
-    with gcloud_connect() as client:
-        return [x.dataset_id for x in client.list_datasets()]
-
-
-def get_tables(dataset) -> list:
-    with gcloud_connect() as client:
-        return [x.table_id for x in client.list_tables(dataset)]
-
-
-def normalize_columns(df):
-    import re
-
-    pattern = "^([0-9].)"
-    new_cols = [
-        x.strip()
-        .replace(" ", "_")
-        .replace("-", "_")
-        .replace("?", "")
-        .replace(",", "")
-        .replace(".", "")
-        .replace("/", "_")
-        .replace("(", "")
-        .replace(")", "")
-        .replace("$", "dollar")
-        .replace("%", "percent")
-        .lower()
-        for x in df.columns
-    ]
-    new_cols = [
-        (
-            re.sub(pattern, "_" + re.findall(pattern, x)[0], x)
-            if re.findall(pattern, x)
-            else x
-        )
-        for x in new_cols
-    ]
-    df.columns = new_cols
-    date_cols = [x for x in df.columns if "date" in x.lower()]
-    if date_cols != []:
-        df[date_cols] = df[date_cols].astype("str")
-        df = df.sort_values(date_cols, ascending=True)
-    float_cols = [x for x in df.select_dtypes("float64").columns]
-    int_cols = [x for x in df.select_dtypes("int64").columns]
-    df[float_cols] = df[float_cols].astype("float32")
-    df[int_cols] = df[int_cols].astype("int32")
-    return df
-
-
-def push_to_cloud(
-    df: pd.DataFrame, destination: str, if_exists: str = "append"
-) -> None:
-    df = normalize_columns(df)
-    _ = pandas_gbq.to_gbq(
-        df,
-        destination_table=destination,
-        if_exists=if_exists,
-        credentials=get_credentials(),
-    )
-    return None
+import atexit
+import datetime
+import re
+import threading
+import time
+
+from google.api_core.exceptions import NotFound
+from google.auth.transport.requests import AuthorizedSession
+from google.cloud import bigquery
+from google.oauth2 import service_account
+import os
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from utils import mellanni_modules as mm
+
+# connections kept open per pooled client, enough for concurrent queries from threads
+HTTP_POOL_SIZE = 32
+
+# local parquet cache of query results, see cached_query
+CACHE_FOLDER = os.path.join(mm.user_folder, "bigquery_cache")
+CACHE_TTL = 24 * 60 * 60
+CACHE_MAX_BYTES = 2 * 1024**3
+TABLE_PATTERN = re.compile(
+    r"\b(?:from|join)\s+`?([\w-]+\.[\w-]+(?:\.[\w-]+)?)`?", re.IGNORECASE
+)
+
+# rows per load job when push_to_cloud splits a large frame
+LOAD_CHUNK_ROWS = 500_000
+# partition decorator (table$partition) format per time partitioning type
+PARTITION_FORMATS = {"HOUR": "%Y%m%d%H", "DAY": "%Y%m%d", "MONTH": "%Y%m", "YEAR": "%Y"}
+
+# seconds dataset / table listings are kept in memory, see get_datasets / get_tables
+METADATA_TTL = 5 * 60
+
+# cgk_pricing: source table and local copies of the pulled rows / weekly averages
+PRICE_COMPARISON_TABLE = "auxillary_development.price_comparison"
+PRICE_COMPARISON_COLUMNS = [
+    "datetime",
+    "asin",
+    "brand",
+    "full_price",
+    "coupon",
+    "ld",
+    "final_price",
+]
+PRICE_COMPARISON_STORE = os.path.join(mm.user_folder, "price_comparison.parquet")
+PRICE_COMPARISON_WEEKLY = os.path.join(
+    mm.user_folder, "price_comparison_weekly.parquet"
+)
+CGK_ASINS = ["B01M16WBW1"]
+
+# "bigquery", or "duckdb" to run against local parquet files, see set_backend
+BACKEND = os.getenv("GCLOUD_BACKEND", "bigquery")
+LOCAL_FOLDER = os.path.join(mm.user_folder, "bigquery_local")
+
+# column and dataset.table names accepted by build_query
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_][\w-]*(\.[A-Za-z_][\w-]*){0,2}")
+
+# statistics of every query job run through _run_query, see read_job_log
+JOB_LOG_FILE = os.path.join(mm.user_folder, "bigquery_jobs.csv")
+# default guard for queries, None disables it; can be overridden per call
+MAX_BYTES_BILLED: int | None = None
+
+_lock = threading.Lock()
+_credentials = None
+_clients: dict[tuple, bigquery.Client] = {}
+_bqstorage_client = None
+_metadata: dict[tuple, tuple[float, list]] = {}
+_duckdb = None
+# False once push_to_cloud / delete_rows may have changed the local table set
+_duckdb_views = False
+
+
+def get_credentials():
+    key_path = "credentials/gcloud.json"
+    credentials_from_file = service_account.Credentials.from_service_account_file(
+        key_path
+    )
+    return credentials_from_file
+
+
+def _default_credentials():
+    """service account credentials, read from file once per process"""
+    global _credentials
+    with _lock:
+        if _credentials is None:
+            _credentials = get_credentials()
+        return _credentials
+
+
+def gcloud_connect(credentials=None):
+    """new BigQuery client; use get_client() to reuse the pooled one"""
+    if credentials is None:
+        credentials = _default_credentials()
+    client = bigquery.Client(credentials=credentials, project=credentials.project_id)
+    return client
+
+
+def get_client(credentials=None) -> bigquery.Client:
+    """
+    Process-wide BigQuery client for the given (or default) credentials, created
+    on first use with a pooled HTTP session and reused by every call. Safe to share
+    between threads; all pooled clients are closed at interpreter exit.
+    """
+    if credentials is None:
+        credentials = _default_credentials()
+    key = (
+        getattr(credentials, "service_account_email", None),
+        credentials.project_id,
+    )
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            session = AuthorizedSession(credentials)
+            adapter = HTTPAdapter(
+                pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE
+            )
+            session.mount("https://", adapter)
+            client = bigquery.Client(
+                credentials=credentials, project=credentials.project_id, _http=session
+            )
+            _clients[key] = client
+        return client
+
+
+def get_bqstorage_client():
+    """
+    Shared BigQuery Storage Read API client, created on first use.
+    Requires the google-cloud-bigquery-storage package.
+    """
+    global _bqstorage_client
+    from google.cloud import bigquery_storage
+
+    credentials = _default_credentials()
+    with _lock:
+        if _bqstorage_client is None:
+            _bqstorage_client = bigquery_storage.BigQueryReadClient(
+                credentials=credentials
+            )
+        return _bqstorage_client
+
+
+@atexit.register
+def close_clients() -> None:
+    global _bqstorage_client
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+        if _bqstorage_client is not None:
+            _bqstorage_client.transport.close()
+            _bqstorage_client = None
+
+
+def set_backend(backend: str = "bigquery", folder: str | None = None) -> None:
+    """
+    Switches pull_gcloud, pull_raw, stream_gcloud, pull_many, get_datasets,
+    get_tables and push_to_cloud between BigQuery and a local DuckDB database
+    over parquet files in folder/<dataset>/<table>/ (LOCAL_FOLDER by default),
+    so pipelines can run and be benchmarked offline with the same dataset.table
+    names. Requires the duckdb package.
+    """
+    global BACKEND, LOCAL_FOLDER, _duckdb
+    if backend not in ("bigquery", "duckdb"):
+        raise BaseException(f"Unknown backend: {backend}")
+    with _lock:
+        BACKEND = backend
+        if folder:
+            LOCAL_FOLDER = folder
+        if _duckdb is not None:
+            _duckdb.close()
+            _duckdb = None
+        _metadata.clear()
+
+
+def _local() -> bool:
+    return BACKEND == "duckdb"
+
+
+def _local_path(destination: str) -> str:
+    dataset, table = destination.split(".")[-2:]
+    return os.path.join(LOCAL_FOLDER, dataset, table)
+
+
+def _local_connection():
+    """
+    DuckDB cursor with a schema per dataset folder and a view per table folder.
+    The views are (re)created under the lock only after the table set changed, as
+    concurrent catalog writes on the shared database conflict.
+    """
+    global _duckdb, _duckdb_views
+    import duckdb
+
+    with _lock:
+        if _duckdb is None:
+            _duckdb = duckdb.connect()
+            _duckdb_views = False
+        if not _duckdb_views:
+            for dataset in get_datasets():
+                _duckdb.execute(f'CREATE SCHEMA IF NOT EXISTS "{dataset}"')
+                for table in get_tables(dataset):
+                    files = os.path.join(LOCAL_FOLDER, dataset, table, "*.parquet")
+                    _duckdb.execute(
+                        f'CREATE OR REPLACE VIEW "{dataset}"."{table}" AS '
+                        f"SELECT * FROM read_parquet('{files}', union_by_name=true)"
+                    )
+            _duckdb_views = True
+        return _duckdb.cursor()
+
+
+def _local_tables_changed() -> None:
+    global _duckdb_views
+    with _lock:
+        _duckdb_views = False
+
+
+def _to_duckdb_sql(query: str) -> str:
+    """
+    Translates the BigQuery syntax used here: backtick-quoted names (a project
+    prefix is dropped), @params and IN UNNEST(@array). Other BigQuery-only
+    functions are passed through unchanged.
+    """
+    query = re.sub(
+        r"`(?:[\w-]+\.)?([\w-]+\.[\w-]+)`",
+        lambda m: ".".join(f'"{x}"' for x in m.group(1).split(".")),
+        query,
+    )
+    query = query.replace("`", '"')
+    query = re.sub(r"IN\s+UNNEST\(\s*@(\w+)\s*\)", r"IN (SELECT UNNEST($\1))", query)
+    return re.sub(r"(?<![\w@])@(\w+)", r"$\1", query)
+
+
+class _LocalRows:
+    """the parts of a BigQuery RowIterator used in this module, over a DuckDB result"""
+
+    def __init__(self, table):
+        self.table = table
+        self.total_rows = table.num_rows
+
+    def __iter__(self):
+        return iter(self.table.to_pylist())
+
+    def to_dataframe(self, **kwargs) -> pd.DataFrame:
+        return self.table.to_pandas()
+
+    def to_arrow(self, **kwargs):
+        return self.table
+
+    def to_arrow_iterable(self, **kwargs):
+        return iter(self.table.to_batches())
+
+
+class _LocalJob:
+    """stands in for a QueryJob when the duckdb backend is active"""
+
+    def __init__(self, query: str, job_config=None):
+        self.query = query
+        self.job_id = f"local_{time.time_ns()}"
+        self.job_config = job_config
+        self.started = self.ended = None
+        self._rows = None
+
+    def result(self) -> _LocalRows:
+        if self._rows is None:
+            parameters = {}
+            for x in getattr(self.job_config, "query_parameters", None) or []:
+                parameters[x.name] = x.values if hasattr(x, "values") else x.value
+            self.started = datetime.datetime.now()
+            con = _local_connection()
+            try:
+                table = con.execute(_to_duckdb_sql(self.query), parameters).arrow()
+            finally:
+                con.close()
+            # newer duckdb versions return a record batch reader
+            if hasattr(table, "read_all"):
+                table = table.read_all()
+            self._rows = _LocalRows(table)
+            self.ended = datetime.datetime.now()
+        return self._rows
+
+
+def _push_local(
+    df: pd.DataFrame,
+    destination: str,
+    if_exists: str,
+    partition_field: str | None = None,
+    partition_type: str = "DAY",
+) -> list[dict]:
+    """push_to_cloud for the duckdb backend: one parquet file per push"""
+    import shutil
+
+    start = time.perf_counter()
+    path = _local_path(destination)
+    if os.path.exists(path) and if_exists == "fail":
+        raise BaseException(f"Table {destination} already exists")
+    if os.path.exists(path) and if_exists == "replace":
+        shutil.rmtree(path)
+    if os.path.exists(path) and if_exists == "replace_partitions":
+        fmt = PARTITION_FORMATS[partition_type]
+        replaced = set(pd.to_datetime(df[partition_field]).dt.strftime(fmt))
+        for name in os.listdir(path):
+            file = os.path.join(path, name)
+            existing = pd.read_parquet(file)
+            keep = (
+                ~pd.to_datetime(existing[partition_field])
+                .dt.strftime(fmt)
+                .isin(replaced)
+            )
+            if keep.all():
+                continue
+            os.remove(file)
+            if keep.any():
+                existing[keep].to_parquet(file, index=False)
+    os.makedirs(path, exist_ok=True)
+    file = os.path.join(path, f"{time.time_ns()}.parquet")
+    df.to_parquet(file, index=False)
+    _local_tables_changed()
+    return [
+        {
+            "job_id": None,
+            "rows": len(df),
+            "bytes": os.path.getsize(file),
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+    ]
+
+
+def _price_weeks(prices: pd.DataFrame) -> pd.DataFrame:
+    """Sunday-based weeks: the ISO year / week of the next day"""
+    prices["datetime"] = pd.to_datetime(prices["datetime"])
+    calendar = (prices["datetime"] + pd.DateOffset(days=1)).dt.isocalendar()
+    prices["year"] = calendar["year"]
+    prices["week"] = calendar["week"]
+    return prices
+
+
+def _weekly_prices(prices: pd.DataFrame) -> pd.DataFrame:
+    return prices.groupby(["asin", "year", "week"], as_index=False).agg(
+        brand=("brand", "last"),
+        week_start=("datetime", "min"),
+        full_price=("full_price", "mean"),
+        final_price=("final_price", "mean"),
+        min_final_price=("final_price", "min"),
+        max_final_price=("final_price", "max"),
+        observations=("final_price", "size"),
+    )
+
+
+def cgk_pricing(asins: list[str] | str | None = None):
+    """
+    Updates the local price comparison store for the ASINs and writes
+    prices and weekly averages to cgk_pricing.xlsx in user_folder.
+    Only rows newer than the stored ones are pulled, and only the weeks that
+    received new rows are re-aggregated. The xlsx is written on every run.
+    """
+    if isinstance(asins, str):
+        asins = [asins]
+    asins = list(asins or CGK_ASINS)
+    if os.path.exists(PRICE_COMPARISON_STORE):
+        stored = pd.read_parquet(PRICE_COMPARISON_STORE)
+        years = stored["year"].astype("int64")
+        stored = _price_weeks(stored)
+        changed = (years != stored["year"].astype("int64")).any()
+        if changed and os.path.exists(PRICE_COMPARISON_WEEKLY):
+            # weeks stored with calendar years, rebuild them all
+            os.remove(PRICE_COMPARISON_WEEKLY)
+    else:
+        stored = pd.DataFrame(columns=[*PRICE_COMPARISON_COLUMNS, "year", "week"])
+    last_pulled = stored.groupby("asin")["datetime"].max()
+
+    queries = []
+    new_asins = [x for x in asins if x not in last_pulled.index]
+    if new_asins:
+        queries.append(
+            build_query(
+                PRICE_COMPARISON_TABLE,
+                columns=PRICE_COMPARISON_COLUMNS,
+                filters={"asin": new_asins},
+            )
+        )
+    known_asins = [x for x in asins if x in last_pulled.index]
+    if known_asins:
+        since = last_pulled[known_asins].min().to_pydatetime()
+        queries.append(
+            build_query(
+                PRICE_COMPARISON_TABLE,
+                columns=PRICE_COMPARISON_COLUMNS,
+                date_range=("datetime", since, None, "TIMESTAMP"),
+                filters={"asin": known_asins},
+            )
+        )
+    pulled = [
+        _run_query(query, job_config=_job_config(parameters)).to_dataframe()
+        for query, parameters in queries
+    ]
+    new = pd.concat([x for x in pulled if len(x)] or [stored.iloc[:0]])
+    new = _price_weeks(new)
+    if len(stored):
+        # rows from the >= boundary and from ASINs pulled since a later date
+        known = pd.MultiIndex.from_frame(stored[["asin", "datetime"]])
+        new = new[~pd.MultiIndex.from_frame(new[["asin", "datetime"]]).isin(known)]
+
+    if len(new) == 0 and os.path.exists(PRICE_COMPARISON_WEEKLY):
+        print("No new prices since the last run")
+        prices = stored
+        weekly = pd.read_parquet(PRICE_COMPARISON_WEEKLY)
+    else:
+        prices = pd.concat([x for x in [stored, new] if len(x)] or [new])
+        prices = prices.sort_values(["asin", "datetime"]).reset_index(drop=True)
+        prices.to_parquet(PRICE_COMPARISON_STORE, index=False)
+
+        if os.path.exists(PRICE_COMPARISON_WEEKLY):
+            weekly = pd.read_parquet(PRICE_COMPARISON_WEEKLY)
+            keys = ["asin", "year", "week"]
+            affected = pd.MultiIndex.from_frame(new[keys].drop_duplicates())
+            weekly = weekly[~pd.MultiIndex.from_frame(weekly[keys]).isin(affected)]
+            changed = prices[pd.MultiIndex.from_frame(prices[keys]).isin(affected)]
+            weekly = pd.concat([weekly, _weekly_prices(changed)])
+        else:
+            weekly = _weekly_prices(prices)
+        weekly = weekly.sort_values(["asin", "year", "week"]).reset_index(drop=True)
+        weekly.to_parquet(PRICE_COMPARISON_WEEKLY, index=False)
+
+    prices = prices[prices["asin"].isin(asins)].sort_values("datetime")
+    weekly = weekly[weekly["asin"].isin(asins)]
+    for df in (prices, weekly):
+        for col in df.select_dtypes("datetimetz").columns:
+            df[col] = df[col].dt.tz_localize(None)  # excel can't store timezones
+    with pd.ExcelWriter(
+        os.path.join(mm.user_folder, "cgk_pricing.xlsx"),
+        engine="xlsxwriter",
+    ) as writer:
+        prices.to_excel(writer, sheet_name="cgk", index=False)
+        mm.format_header(prices, writer, "cgk")
+        weekly.to_excel(writer, sheet_name="weekly", index=False)
+        mm.format_header(weekly, writer, "weekly")
+    return None
+
+
+def _make_query(dataset, report, custom_query=None) -> str:
+    if not custom_query:
+        return f"SELECT * FROM `{dataset}.{report}` LIMIT 10"
+    return custom_query
+
+
+def _identifier(name: str) -> str:
+    if not IDENTIFIER_PATTERN.fullmatch(name):
+        raise BaseException(f"Invalid column or table name: {name}")
+    return f"`{name}`"
+
+
+def _query_parameter(name: str, value):
+    """scalar (or array for lists) query parameter typed from the python value"""
+    if pd.api.types.is_list_like(value):
+        values = [_query_parameter(name, x).value for x in value]
+        kind = _query_parameter(name, values[0]).type_ if values else "STRING"
+        return bigquery.ArrayQueryParameter(name, kind, values)
+    if hasattr(value, "item") and not isinstance(value, datetime.date):
+        value = value.item()  # numpy scalars
+    if isinstance(value, bool):
+        kind = "BOOL"
+    elif isinstance(value, int):
+        kind = "INT64"
+    elif isinstance(value, float):
+        kind = "FLOAT64"
+    elif isinstance(value, datetime.datetime):
+        kind = "TIMESTAMP" if value.tzinfo else "DATETIME"
+    elif isinstance(value, datetime.date):
+        kind = "DATE"
+    else:
+        kind = "STRING"
+    return bigquery.ScalarQueryParameter(name, kind, value)
+
+
+def build_query(
+    table: str,
+    columns: list[str] | None = None,
+    date_range: tuple | None = None,
+    filters: dict | None = None,
+    limit: int | None = None,
+) -> tuple[str, list]:
+    """
+    Builds a SELECT that reads only the needed columns and, on date-partitioned
+    tables, only the partitions in the date range. Values are passed as query
+    parameters, never formatted into the SQL.
+
+    Args:
+        table: "dataset.table"
+        columns: columns to select, all if None
+        date_range: (date column, start, end), both ends inclusive, either can be
+            None; dates may be date/datetime objects or "YYYY-MM-DD" strings.
+            An optional fourth element gives the column type for the parameters:
+            "DATE" (the default for strings), "DATETIME", "TIMESTAMP" or "STRING".
+        filters: column -> value for "=", a list (or array) for "IN", None for "IS NULL"
+        limit: optional row limit
+
+    Returns the SQL and the list of query parameters for QueryJobConfig.
+    """
+    select = ", ".join(_identifier(x) for x in columns) if columns else "*"
+    where, parameters = _where(date_range, filters)
+    query = f"SELECT {select} FROM {_identifier(table)}{where}"
+    if limit:
+        query += f" LIMIT {int(limit)}"
+    return query, parameters
+
+
+def _date_bound(operator: str, value, date_type: str | None = None):
+    """
+    Operator and parameter value of a date_range bound for a column of date_type
+    ("DATE", "DATETIME", "TIMESTAMP" or "STRING" with ISO dates). Without a type
+    strings are DATE and date/datetime objects keep their own type. An end date
+    without a time on a time column becomes "< the next day".
+    """
+    if date_type is None:
+        if isinstance(value, str):
+            value = datetime.date.fromisoformat(value)
+        return operator, value
+    if date_type not in ("DATE", "DATETIME", "TIMESTAMP", "STRING"):
+        raise BaseException(f"Unknown date type: {date_type}")
+    value = pd.Timestamp(value)
+    if date_type == "DATE":
+        return operator, value.date()
+    if operator == "<=" and value == value.normalize():
+        operator, value = "<", value + pd.Timedelta(days=1)
+    if date_type == "TIMESTAMP":
+        value = value.tz_localize("UTC") if value.tzinfo is None else value
+        return operator, value.to_pydatetime()
+    value = value.tz_convert("UTC").tz_localize(None) if value.tzinfo else value
+    if date_type == "DATETIME":
+        return operator, value.to_pydatetime()
+    return operator, str(value.date()) if value == value.normalize() else str(value)
+
+
+def _where(date_range: tuple | None = None, filters: dict | None = None):
+    """WHERE clause and query parameters for build_query / delete_rows"""
+    conditions, parameters = [], []
+    if date_range:
+        date_column, start, end, *date_type = date_range
+        for operator, value in ((">=", start), ("<=", end)):
+            if value is None:
+                continue
+            operator, value = _date_bound(operator, value, *date_type)
+            name = f"p{len(parameters)}"
+            conditions.append(f"{_identifier(date_column)} {operator} @{name}")
+            parameters.append(_query_parameter(name, value))
+    for column, value in (filters or {}).items():
+        if value is None:
+            conditions.append(f"{_identifier(column)} IS NULL")
+            continue
+        name = f"p{len(parameters)}"
+        if pd.api.types.is_list_like(value):
+            conditions.append(f"{_identifier(column)} IN UNNEST(@{name})")
+        else:
+            conditions.append(f"{_identifier(column)} = @{name}")
+        parameters.append(_query_parameter(name, value))
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    return where, parameters
+
+
+def delete_rows(
+    table: str,
+    date_range: tuple | None = None,
+    filters: dict | None = None,
+    starts: tuple | None = None,
+) -> None:
+    """
+    Deletes the matching rows with one parameterised DML statement; on the duckdb
+    backend the table's parquet files are rewritten without them.
+
+    Args:
+        date_range, filters: see build_query
+        starts: (key column, date column, {key: first date}) to delete the rows
+            of each key from its own first date on
+    """
+    where, parameters = _where(date_range, filters)
+    conditions = [where.removeprefix(" WHERE ")] if where else []
+    if starts:
+        key_column, date_column, first = starts
+        name = f"p{len(parameters)}"
+        # the earliest date lets BigQuery prune partitions
+        conditions.append(f"{_identifier(date_column)} >= @{name}")
+        parameters.append(_query_parameter(name, min(first.values())))
+        conditions.append(
+            "EXISTS (SELECT 1 FROM {starts} AS s WHERE "
+            f"s.key = {_identifier(key_column)} AND "
+            f"{_identifier(date_column)} >= s.start)"
+        )
+    if not conditions:
+        raise BaseException("delete_rows needs a date_range, filters or starts")
+    condition = " AND ".join(conditions)
+    if not _local():
+        if starts:
+            name = f"p{len(parameters)}"
+            condition = condition.replace("{starts}", f"UNNEST(@{name})")
+            parameters.append(
+                bigquery.ArrayQueryParameter(
+                    name,
+                    "STRUCT",
+                    [
+                        bigquery.StructQueryParameter(
+                            None,
+                            _query_parameter("key", key),
+                            _query_parameter("start", start),
+                        )
+                        for key, start in first.items()
+                    ],
+                )
+            )
+        _run_query(
+            f"DELETE FROM {_identifier(table)} WHERE {condition}",
+            job_config=_job_config(parameters),
+        )
+        return
+    import pyarrow.parquet as pq
+
+    path = _local_path(table)
+    if not os.path.exists(path):
+        return
+    condition = _to_duckdb_sql(condition.replace("{starts}", "_starts"))
+    values = {x.name: x.values if hasattr(x, "values") else x.value for x in parameters}
+    con = _local_connection()
+    try:
+        if starts:
+            con.register(
+                "_starts",
+                pd.DataFrame(
+                    {"key": list(first), "start": pd.to_datetime(list(first.values()))}
+                ),
+            )
+        for name in os.listdir(path):
+            file = os.path.join(path, name)
+            kept = con.execute(
+                f"SELECT * FROM read_parquet('{file}') "
+                f"WHERE NOT COALESCE({condition}, FALSE)",
+                values,
+            ).arrow()
+            if hasattr(kept, "read_all"):
+                kept = kept.read_all()
+            if kept.num_rows < pq.read_metadata(file).num_rows:
+                # a new file name, duckdb caches the metadata of files it has read
+                if kept.num_rows:
+                    pq.write_table(
+                        kept, os.path.join(path, f"{time.time_ns()}.parquet")
+                    )
+                os.remove(file)
+    finally:
+        con.close()
+        _local_tables_changed()
+
+
+def _arrow_to_frame(arrow_data, dtypes: dict | None = None) -> pd.DataFrame:
+    """
+    Converts an Arrow table or record batch to pandas, decoding "category" columns
+    straight to categoricals and casting the rest of dtypes (e.g. "float32").
+    """
+    dtypes = dtypes or {}
+    categories = [col for col, dtype in dtypes.items() if dtype == "category"]
+    df = arrow_data.to_pandas(categories=categories)
+    other = {col: dtype for col, dtype in dtypes.items() if dtype != "category"}
+    if other:
+        df = df.astype(other)
+    return df
+
+
+def _job_config(query_parameters: list | None = None) -> bigquery.QueryJobConfig:
+    return bigquery.QueryJobConfig(query_parameters=query_parameters or [])
+
+
+def estimate_bytes(query: str, job_config=None) -> int:
+    """bytes the query would process, from a free dry run"""
+    if _local():
+        return 0
+    dry_config = bigquery.QueryJobConfig(
+        dry_run=True,
+        use_query_cache=False,
+        query_parameters=job_config.query_parameters if job_config else [],
+    )
+    job = get_client().query(query, job_config=dry_config)
+    return job.total_bytes_processed or 0
+
+
+def _submit_query(
+    query: str, job_config=None, max_bytes: int | None = None
+) -> bigquery.QueryJob:
+    """
+    Starts a query job. With max_bytes (or MAX_BYTES_BILLED) set, the query is
+    dry-run first and refused if it would process more than that; the limit is
+    also passed to BigQuery as maximum_bytes_billed.
+    """
+    if _local():
+        return _LocalJob(query, job_config)
+    max_bytes = max_bytes or MAX_BYTES_BILLED
+    job_config = job_config or bigquery.QueryJobConfig()
+    if max_bytes:
+        estimate = estimate_bytes(query, job_config)
+        if estimate > max_bytes:
+            raise BaseException(
+                f"Query would process {estimate:,} bytes, over the limit of "
+                f"{max_bytes:,}:\n{_normalize_sql(query)[:500]}"
+            )
+        job_config.maximum_bytes_billed = max_bytes
+    return get_client().query(query, job_config=job_config)
+
+
+def _log_job(job: bigquery.QueryJob) -> dict:
+    """appends the statistics of a finished query job to JOB_LOG_FILE"""
+    if isinstance(job, _LocalJob):
+        return {}
+    stats = {
+        "created": job.created,
+        "job_id": job.job_id,
+        "bytes_processed": job.total_bytes_processed,
+        "bytes_billed": job.total_bytes_billed,
+        "cache_hit": job.cache_hit,
+        "slot_ms": job.slot_millis,
+        "seconds": (
+            (job.ended - job.started).total_seconds()
+            if job.started and job.ended
+            else None
+        ),
+        "query": _normalize_sql(job.query or "")[:1000],
+    }
+    try:
+        with _lock:
+            os.makedirs(os.path.dirname(JOB_LOG_FILE), exist_ok=True)
+            pd.DataFrame([stats]).to_csv(
+                JOB_LOG_FILE,
+                mode="a",
+                header=not os.path.exists(JOB_LOG_FILE),
+                index=False,
+            )
+    except Exception as e:
+        print(f"Job statistics could not be logged: {e}")
+    return stats
+
+
+def _run_query(query: str, job_config=None, max_bytes: int | None = None):
+    """runs a query through the bytes guard, waits for it and logs its statistics"""
+    job = _submit_query(query, job_config=job_config, max_bytes=max_bytes)
+    rows = job.result()
+    _log_job(job)
+    return rows
+
+
+def read_job_log(top: int | None = None) -> pd.DataFrame:
+    """logged query jobs, most bytes billed first"""
+    if not os.path.exists(JOB_LOG_FILE):
+        return pd.DataFrame()
+    log = pd.read_csv(JOB_LOG_FILE).sort_values("bytes_billed", ascending=False)
+    return log.head(top) if top else log
+
+
+def _fetch_job(job, use_storage_api: bool, dtypes: dict | None) -> pd.DataFrame:
+    rows = job.result()
+    _log_job(job)
+    if not use_storage_api and not dtypes:
+        return rows.to_dataframe()
+    bqstorage_client = (
+        get_bqstorage_client() if use_storage_api and not _local() else None
+    )
+    return _arrow_to_frame(
+        rows.to_arrow(bqstorage_client=bqstorage_client, create_bqstorage_client=False),
+        dtypes,
+    )
+
+
+def pull_raw(
+    dataset="auxillary_development",
+    report="dictionary",
+    custom_query=None,
+    max_bytes: int | None = None,
+):
+    query = _make_query(dataset, report, custom_query)
+    data = _run_query(query, max_bytes=max_bytes)
+    return data
+
+
+def pull_gcloud(
+    dataset="auxillary_development",
+    report="dictionary",
+    custom_query=None,
+    use_storage_api: bool = False,
+    chunked: bool = False,
+    dtypes: dict | None = None,
+    cache: bool = False,
+    cache_ttl: int = CACHE_TTL,
+    max_bytes: int | None = None,
+    columns: list[str] | None = None,
+    date_range: tuple | None = None,
+    filters: dict | None = None,
+    query_parameters: list | None = None,
+) -> pd.DataFrame:
+    """
+    Runs a query and returns the result as a DataFrame.
+    Without custom_query, columns / date_range / filters select from
+    dataset.report through build_query (all rows, not the default LIMIT 10).
+
+    Args:
+        use_storage_api: read the result through the BigQuery Storage Read API as
+            Arrow record batches instead of the REST pager (much faster for large results).
+        chunked: return a generator of DataFrame chunks instead of one DataFrame,
+            see stream_gcloud.
+        dtypes: optional column -> dtype mapping applied while converting,
+            e.g. {"asin": "category", "price": "float32"}.
+        cache: return a locally cached result if the same query was run within
+            cache_ttl seconds and the referenced tables haven't changed, see cached_query.
+        max_bytes: refuse to run the query if a dry run estimates it would process
+            more bytes than this (defaults to MAX_BYTES_BILLED).
+        columns, date_range, filters: see build_query.
+        query_parameters: parameters referenced as @name by custom_query.
+    """
+    if not custom_query and (columns or date_range or filters):
+        custom_query, query_parameters = build_query(
+            f"{dataset}.{report}",
+            columns=columns,
+            date_range=date_range,
+            filters=filters,
+        )
+    if chunked:
+        return stream_gcloud(
+            dataset,
+            report,
+            custom_query,
+            use_storage_api=use_storage_api,
+            dtypes=dtypes,
+            max_bytes=max_bytes,
+            query_parameters=query_parameters,
+        )
+    query = _make_query(dataset, report, custom_query)
+    if cache:
+        return cached_query(
+            query,
+            ttl=cache_ttl,
+            use_storage_api=use_storage_api,
+            dtypes=dtypes,
+            max_bytes=max_bytes,
+            query_parameters=query_parameters,
+        )
+    job = _submit_query(
+        query, job_config=_job_config(query_parameters), max_bytes=max_bytes
+    )
+    return _fetch_job(job, use_storage_api, dtypes)
+
+
+def stream_gcloud(
+    dataset="auxillary_development",
+    report="dictionary",
+    custom_query=None,
+    use_storage_api: bool = True,
+    dtypes: dict | None = None,
+    max_bytes: int | None = None,
+    query_parameters: list | None = None,
+):
+    """
+    Yields the query result as DataFrame chunks, one per Arrow record batch, so
+    results larger than memory can be processed incrementally.
+    """
+    query = _make_query(dataset, report, custom_query)
+    rows = _run_query(
+        query, job_config=_job_config(query_parameters), max_bytes=max_bytes
+    )
+    bqstorage_client = (
+        get_bqstorage_client() if use_storage_api and not _local() else None
+    )
+    for batch in rows.to_arrow_iterable(bqstorage_client=bqstorage_client):
+        yield _arrow_to_frame(batch, dtypes)
+
+
+def pull_many(
+    queries: dict[str, str],
+    use_storage_api: bool = False,
+    dtypes: dict | None = None,
+    max_workers: int = 8,
+    max_bytes: int | None = None,
+) -> tuple[dict[str, pd.DataFrame], pd.DataFrame]:
+    """
+    Runs a named set of queries as concurrent BigQuery jobs, so a report needing
+    several tables waits for the slowest query instead of the sum of all of them.
+
+    Args:
+        queries: name -> SQL
+        use_storage_api, dtypes, max_bytes: as in pull_gcloud, applied to every query
+        max_workers: results downloaded in parallel
+
+    Returns:
+        name -> DataFrame, and a DataFrame of per-job timings (seconds until the
+        result was downloaded, BigQuery run time, rows)
+    """
+    start = time.perf_counter()
+    jobs = {
+        name: _submit_query(query, max_bytes=max_bytes)
+        for name, query in queries.items()
+    }
+    results, timings = {}, []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(_fetch_job, job, use_storage_api, dtypes): name
+            for name, job in jobs.items()
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            job = jobs[name]
+            results[name] = future.result()
+            timings.append(
+                {
+                    "query": name,
+                    "job_id": job.job_id,
+                    "seconds": round(time.perf_counter() - start, 3),
+                    "job_seconds": (
+                        (job.ended - job.started).total_seconds()
+                        if job.started and job.ended
+                        else None
+                    ),
+                    "rows": len(results[name]),
+                }
+            )
+    return results, pd.DataFrame(timings)
+
+
+def _normalize_sql(query: str) -> str:
+    return " ".join(query.split()).rstrip(";").strip()
+
+
+def _table_versions(query: str) -> list[str] | None:
+    """
+    Last-modified times of the tables referenced by the query, or None if any
+    of them can't be resolved (e.g. wildcard tables) or is a view or an external
+    table, whose modified time doesn't follow the data; the result isn't cached then.
+    """
+    if _local():
+        return None
+    client = get_client()
+    versions = []
+    for table in sorted(set(TABLE_PATTERN.findall(query))):
+        try:
+            table_info = client.get_table(table)
+        except Exception:
+            return None
+        if table_info.table_type in ("VIEW", "MATERIALIZED_VIEW", "EXTERNAL"):
+            return None
+        modified = table_info.modified
+        versions.append(f"{table}:{modified.isoformat() if modified else ''}")
+    return versions
+
+
+def _evict_cache(ttl: int = CACHE_TTL, max_bytes: int = CACHE_MAX_BYTES) -> None:
+    """removes expired results, then the oldest ones until the cache fits max_bytes"""
+    now = time.time()
+    files = []
+    for name in os.listdir(CACHE_FOLDER):
+        path = os.path.join(CACHE_FOLDER, name)
+        stat = os.stat(path)
+        if now - stat.st_mtime > ttl:
+            os.remove(path)
+        else:
+            files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(x[1] for x in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+
+
+def cached_query(
+    query: str,
+    ttl: int = CACHE_TTL,
+    use_storage_api: bool = False,
+    dtypes: dict | None = None,
+    max_bytes: int | None = None,
+    query_parameters: list | None = None,
+) -> pd.DataFrame:
+    """
+    Runs a query through a parquet cache in user_folder keyed by the normalized SQL,
+    its query parameters, dtypes and use_storage_api and the last-modified times of
+    the referenced tables. A cached result is returned while it is younger than ttl
+    seconds and none of the tables have changed. Files older than CACHE_TTL are
+    evicted whatever the ttl of the call that wrote them.
+    """
+    versions = _table_versions(query)
+    if versions is None:
+        return pull_gcloud(
+            custom_query=query,
+            use_storage_api=use_storage_api,
+            dtypes=dtypes,
+            max_bytes=max_bytes,
+            query_parameters=query_parameters,
+        )
+    if not os.path.exists(CACHE_FOLDER):
+        os.makedirs(CACHE_FOLDER)
+    parameters = [repr(x.to_api_repr()) for x in query_parameters or []]
+    options = [repr(sorted((dtypes or {}).items())), str(use_storage_api)]
+    key = mm.encrypt_string(
+        "|".join([_normalize_sql(query), *parameters, *options, *versions])
+    )
+    path = os.path.join(CACHE_FOLDER, f"{key}.parquet")
+    if os.path.exists(path) and time.time() - os.path.getmtime(path) < ttl:
+        return pd.read_parquet(path)
+    data = pull_gcloud(
+        custom_query=query,
+        use_storage_api=use_storage_api,
+        dtypes=dtypes,
+        max_bytes=max_bytes,
+        query_parameters=query_parameters,
+    )
+    try:
+        data.to_parquet(path)
+    except Exception as e:
+        print(f"Query result could not be cached: {e}")
+    _evict_cache()
+    return data
+
+
+def _cached_listing(key: tuple, fetch, refresh: bool = False) -> list:
+    """in-process cache of metadata listings, kept for METADATA_TTL seconds"""
+    with _lock:
+        cached = _metadata.get(key)
+    if cached and not refresh and time.time() - cached[0] < METADATA_TTL:
+        return list(cached[1])
+    listing = fetch()
+    with _lock:
+        _metadata[key] = (time.time(), listing)
+    return list(listing)
+
+
+def get_datasets(refresh: bool = False) -> list:
+    if _local():
+        if not os.path.exists(LOCAL_FOLDER):
+            return []
+        return sorted(
+            x
+            for x in os.listdir(LOCAL_FOLDER)
+            if os.path.isdir(os.path.join(LOCAL_FOLDER, x))
+        )
+    return _cached_listing(
+        ("datasets",),
+        lambda: [x.dataset_id for x in get_client().list_datasets()],
+        refresh=refresh,
+    )
+
+
+def get_tables(dataset, refresh: bool = False) -> list:
+    if _local():
+        folder = os.path.join(LOCAL_FOLDER, dataset)
+        if not os.path.exists(folder):
+            return []
+        return sorted(
+            x for x in os.listdir(folder) if os.path.isdir(os.path.join(folder, x))
+        )
+    return _cached_listing(
+        ("tables", dataset),
+        lambda: [x.table_id for x in get_client().list_tables(dataset)],
+        refresh=refresh,
+    )
+
+
+def normalize_columns(df):
+    import re
+
+    pattern = "^([0-9].)"
+    new_cols = [
+        x.strip()
+        .replace(" ", "_")
+        .replace("-", "_")
+        .replace("?", "")
+        .replace(",", "")
+        .replace(".", "")
+        .replace("/", "_")
+        .replace("(", "")
+        .replace(")", "")
+        .replace("$", "dollar")
+        .replace("%", "percent")
+        .lower()
+        for x in df.columns
+    ]
+    new_cols = [
+        (
+            re.sub(pattern, "_" + re.findall(pattern, x)[0], x)
+            if re.findall(pattern, x)
+            else x
+        )
+        for x in new_cols
+    ]
+    df.columns = new_cols
+    date_cols = [x for x in df.columns if "date" in x.lower()]
+    if date_cols != []:
+        df[date_cols] = df[date_cols].astype("str")
+        df = df.sort_values(date_cols, ascending=True)
+    numeric_cols = [x for x in df.select_dtypes(["float64", "int64"]).columns]
+    if numeric_cols:
+        compact = mm.compact_frame(
+            df[numeric_cols], categories=False, floats_to_int=False
+        )
+        for col in numeric_cols:
+            df[col] = compact[col]
+    return df
+
+
+def _bigquery_schema(df: pd.DataFrame) -> list[bigquery.SchemaField]:
+    """BigQuery schema matching the frame's dtypes"""
+    schema = []
+    for col, dtype in df.dtypes.items():
+        if pd.api.types.is_bool_dtype(dtype):
+            field_type = "BOOLEAN"
+        elif pd.api.types.is_integer_dtype(dtype):
+            field_type = "INTEGER"
+        elif pd.api.types.is_float_dtype(dtype):
+            field_type = "FLOAT"
+        elif isinstance(dtype, pd.DatetimeTZDtype):
+            field_type = "TIMESTAMP"
+        elif pd.api.types.is_datetime64_dtype(dtype):
+            field_type = "DATETIME"
+        else:
+            values = df[col].dropna()
+            first = values.iloc[0] if len(values) > 0 else None
+            field_type = (
+                "DATE"
+                if isinstance(first, datetime.date)
+                and not isinstance(first, datetime.datetime)
+                else "STRING"
+            )
+        schema.append(bigquery.SchemaField(col, field_type))
+    return schema
+
+
+def _string_columns(
+    df: pd.DataFrame, schema: list[bigquery.SchemaField]
+) -> pd.DataFrame:
+    """
+    Casts the values of STRING columns to str, keeping nulls: parquet can't store
+    object columns mixing types, e.g. text filled with fillna(0).
+    """
+    strings = [
+        x.name
+        for x in schema
+        if x.field_type == "STRING"
+        and x.name in df.columns
+        and not pd.api.types.is_string_dtype(df[x.name].dropna().infer_objects())
+    ]
+    if not strings:
+        return df
+    df = df.copy()
+    for col in strings:
+        values = df[col].astype(object)
+        df[col] = values.where(values.isnull(), values.astype(str))
+    return df
+
+
+def _load_chunk(client, df, destination, job_config) -> dict:
+    job = client.load_table_from_dataframe(df, destination, job_config=job_config)
+    job.result()
+    return {
+        "job_id": job.job_id,
+        "rows": job.output_rows,
+        "bytes": job.output_bytes,
+        "seconds": (
+            (job.ended - job.started).total_seconds()
+            if job.ended and job.started
+            else None
+        ),
+    }
+
+
+def push_to_cloud(
+    df: pd.DataFrame,
+    destination: str,
+    if_exists: str = "append",
+    schema: list[bigquery.SchemaField] | None = None,
+    partition_field: str | None = None,
+    chunk_rows: int = LOAD_CHUNK_ROWS,
+    max_workers: int = 4,
+    partition_type: str = "DAY",
+    clustering_fields: list[str] | None = None,
+) -> list[dict]:
+    """
+    Loads a DataFrame to a BigQuery table as parquet load jobs.
+
+    Args:
+        if_exists: "append", "replace" or "fail" if the table already exists, or
+            "replace_partitions" to atomically overwrite only the partitions present
+            in df (one WRITE_TRUNCATE job per table$partition), keeping the others.
+        schema: explicit schema; by default it is derived from the dtypes for new
+            or replaced tables, and taken from the table itself when appending.
+        partition_field: DATE/TIMESTAMP column to partition the table by
+            when it is created; this and clustering_fields may be given as in df
+            or in their normalized form.
+        chunk_rows: frames larger than this are split and the chunks after the
+            first are loaded as parallel append jobs (a replace is not atomic then).
+        partition_type: "DAY", "MONTH", "YEAR" or "HOUR" (needs a TIMESTAMP column).
+        clustering_fields: up to four columns to cluster the table by when it is
+            created.
+
+    Returns job statistics (job_id, rows, bytes, seconds) for each load job.
+    """
+    if partition_type not in PARTITION_FORMATS:
+        raise BaseException(f"Unknown partition type: {partition_type}")
+    if if_exists == "replace_partitions" and not partition_field:
+        raise BaseException("replace_partitions needs a partition_field")
+    # df's columns are renamed by normalize_columns, the fields the same way
+    if partition_field:
+        partition_field = normalize_columns(
+            pd.DataFrame(columns=[partition_field])
+        ).columns[0]
+    if clustering_fields:
+        clustering_fields = normalize_columns(
+            pd.DataFrame(columns=clustering_fields)
+        ).columns.tolist()
+    if _local():
+        # only the names: the local parquet keeps the date dtypes so that
+        # date_range filters compare dates rather than strings
+        df = df.set_axis(normalize_columns(df.iloc[:0].copy()).columns, axis=1)
+    else:
+        df = normalize_columns(df)
+    if partition_field:
+        # date columns may be strings, partitioning needs a DATE
+        df[partition_field] = pd.to_datetime(df[partition_field])
+        if partition_type != "HOUR":
+            df[partition_field] = df[partition_field].dt.date
+    if _local():
+        return _push_local(df, destination, if_exists, partition_field, partition_type)
+    client = get_client()
+    try:
+        existing = client.get_table(destination)
+    except NotFound:
+        existing = None
+    table_exists = existing is not None
+    if table_exists and if_exists == "fail":
+        raise BaseException(f"Table {destination} already exists")
+    if schema is None and (not table_exists or if_exists == "replace"):
+        schema = _bigquery_schema(df)
+    df = _string_columns(df, schema or existing.schema)
+    time_partitioning = (
+        bigquery.TimePartitioning(type_=partition_type, field=partition_field)
+        if partition_field
+        else None
+    )
+
+    def job_config(write_disposition):
+        return bigquery.LoadJobConfig(
+            schema=schema,
+            write_disposition=write_disposition,
+            source_format=bigquery.SourceFormat.PARQUET,
+            time_partitioning=time_partitioning,
+            clustering_fields=clustering_fields,
+        )
+
+    if if_exists == "replace_partitions":
+        if not table_exists:
+            table = bigquery.Table(
+                bigquery.TableReference.from_string(
+                    destination, default_project=client.project
+                ),
+                schema=schema,
+            )
+            table.time_partitioning = time_partitioning
+            table.clustering_fields = clustering_fields
+            client.create_table(table)
+        partitions = pd.to_datetime(df[partition_field]).dt.strftime(
+            PARTITION_FORMATS[partition_type]
+        )
+        truncate_config = job_config(bigquery.WriteDisposition.WRITE_TRUNCATE)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            stats = list(
+                executor.map(
+                    lambda item: _load_chunk(
+                        client, item[1], f"{destination}${item[0]}", truncate_config
+                    ),
+                    df.groupby(partitions.to_numpy()),
+                )
+            )
+    else:
+        chunks = [
+            df.iloc[i : i + chunk_rows] for i in range(0, max(len(df), 1), chunk_rows)
+        ]
+        first_disposition = (
+            bigquery.WriteDisposition.WRITE_TRUNCATE
+            if if_exists == "replace"
+            else bigquery.WriteDisposition.WRITE_APPEND
+        )
+        stats = [
+            _load_chunk(client, chunks[0], destination, job_config(first_disposition))
+        ]
+        if len(chunks) > 1:
+            append_config = job_config(bigquery.WriteDisposition.WRITE_APPEND)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                stats.extend(
+                    executor.map(
+                        lambda chunk: _load_chunk(
+                            client, chunk, destination, append_config
+                        ),
+                        chunks[1:],
+                    )
+                )
+    if not table_exists:
+        with _lock:
+            _metadata.pop(("tables", destination.rsplit(".", 1)[0]), None)
+    return stats
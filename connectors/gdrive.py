@@ -1,51 +1,113 @@
 import pickle
-from io import BytesIO, StringIO
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO, UnsupportedOperation
 import os.path
 import pandas as pd
 from typing import Literal
 
 import gdown
 import gspread
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload, MediaIoBaseUpload
 
+from common import user_folder
+
 # Update the scopes to include access to Shared Drives
 SCOPES = ["https://www.googleapis.com/auth/drive"]
 
+# bytes per request of chunked Drive transfers, a multiple of 256 KB for uploads
+TRANSFER_CHUNK_SIZE = 32 * 1024 * 1024
+# spooled downloads stay in memory up to this size, then roll over to a temp file
+SPOOL_MAX_MEMORY = 64 * 1024 * 1024
+# HTTP statuses worth retrying a transfer for
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+
+# seconds after which DriveIndex lookups pull pending changes from Drive
+INDEX_MAX_AGE = 5 * 60
+
+_lock = threading.RLock()
+_credentials = None
+_services = {}
+_indexes = {}
 
-def gdownload(file_id):
-    buf = BytesIO()
+
+def gdownload(file_id, output=None):
+    """
+    Downloads a publicly shared file with gdown into output, a file path or
+    a writable file object (written as it streams in), or a new BytesIO.
+    """
+    buf = BytesIO() if output is None else output
     _ = gdown.download(id=file_id, output=buf)
-    buf.seek(0)
+    if hasattr(buf, "seek"):
+        buf.seek(0)
     return buf
 
 
+def get_credentials():
+    """
+    Drive credentials from .secrets/gdrive.pickle, read once per process and
+    refreshed (or re-authorized through the browser) when no longer valid.
+    """
+    global _credentials
+    with _lock:
+        creds = _credentials
+        if creds is None and os.path.exists(".secrets/gdrive.pickle"):
+            with open(".secrets/gdrive.pickle", "rb") as token:
+                creds = pickle.load(token)
+        if not creds or not creds.valid:
+            if creds and creds.expired and creds.refresh_token:
+                creds.refresh(Request())
+            else:
+                flow = InstalledAppFlow.from_client_secrets_file(
+                    "credentials/gdrive.json", SCOPES
+                )
+                creds = flow.run_local_server(port=0)
+            with open(".secrets/gdrive.pickle", "wb") as token:
+                pickle.dump(creds, token)
+        _credentials = creds
+        return creds
+
+
 def connect(scope: Literal["files", "gspread"] = "files"):
-    creds = None
-    if os.path.exists(".secrets/gdrive.pickle"):
-        with open(".secrets/gdrive.pickle", "rb") as token:
-            creds = pickle.load(token)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                "credentials/gdrive.json", SCOPES
-            )
-            creds = flow.run_local_server(port=0)
-        with open(".secrets/gdrive.pickle", "wb") as token:
-            pickle.dump(creds, token)
+    """new Drive / gspread client; use get_service() to reuse the cached one"""
+    creds = get_credentials()
     if scope == "files":
-        service = build("drive", "v3", credentials=creds)
+        # discovery document bundled with googleapiclient, no request to fetch it
+        service = build(
+            "drive",
+            "v3",
+            credentials=creds,
+            static_discovery=True,
+            cache_discovery=False,
+        )
     elif scope == "gspread":
         service = gspread.authorize(creds)
     return service
 
 
-def delete_file(file_id, service=connect()):
+def get_service(scope: Literal["files", "gspread"] = "files"):
+    """Drive (or gspread) client created on first use and reused afterwards"""
+    with _lock:
+        service = _services.get(scope)
+    if service is None:
+        service = connect(scope)
+        with _lock:
+            service = _services.setdefault(scope, service)
+    return service
+
+
+def delete_file(file_id, service=None):
+    service = service or get_service()
     try:
         service.files().delete(fileId=file_id, supportsAllDrives=True).execute()
         print(f"File with ID: {file_id} has been deleted successfully.")
@@ -53,9 +115,8 @@ def delete_file(file_id, service=connect()):
         print(f"An error occurred while deleting the file: {error}")
 
 
-def download_gspread(
-    service=connect(scope="gspread"), spreadsheet_id=None, sheet_id=None, header=1
-):
+def download_gspread(service=None, spreadsheet_id=None, sheet_id=None, header=1):
+    service = service or get_service(scope="gspread")
     if not spreadsheet_id:
         raise BaseException("Spreadsheet ID not indicated")
     sheet = 0 if not sheet_id else sheet_id
@@ -65,7 +126,8 @@ def download_gspread(
     return data
 
 
-def create_folder(folder_name, parent_folder):
+def create_folder(folder_name, parent_folder, service=None):
+    service = service or get_service()
     # Create a folder
     file_metadata = {
         "name": folder_name,
@@ -73,8 +135,7 @@ def create_folder(folder_name, parent_folder):
         "parents": [parent_folder],
     }
     folder = (
-        connect()
-        .files()
+        service.files()
         .create(body=file_metadata, fields="id", supportsAllDrives=True)
         .execute()
     )
@@ -82,7 +143,8 @@ def create_folder(folder_name, parent_folder):
     return folder.get("id")
 
 
-def list_shared_drives(service=connect()):
+def list_shared_drives(service=None):
+    service = service or get_service()
     shared_drives = []
     page_token = None
     while True:
@@ -136,7 +198,8 @@ def list_folders(service, drive_id):
     return folders
 
 
-def list_files_in_folder(folder_id, drive_id, service=connect()):
+def list_files_in_folder(folder_id, drive_id, service=None):
+    service = service or get_service()
     files = {}
     page_token = None
     while True:
@@ -171,12 +234,241 @@ def list_files_in_folder(folder_id, drive_id, service=connect()):
     return files
 
 
+class DriveIndex:
+    """
+    Local sqlite index of a shared drive's files and folders.
+    The first sync lists the whole drive; later syncs only apply the Drive
+    changes feed from a persisted page token, and are skipped while the last
+    one is younger than max_age seconds.
+    """
+
+    FILE_FIELDS = "id, name, mimeType, parents, modifiedTime, size, trashed"
+
+    def __init__(
+        self,
+        drive_id: str,
+        path: str | None = None,
+        service=None,
+        max_age: int = INDEX_MAX_AGE,
+    ):
+        self.drive_id = drive_id
+        self.path = path or os.path.join(user_folder, f"gdrive_{drive_id}.sqlite")
+        self.service = service
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                id TEXT PRIMARY KEY, name TEXT, mime_type TEXT, parent TEXT,
+                modified TEXT, size INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS files_parent ON files (parent, name);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            """)
+
+    def _get_meta(self, key):
+        row = self._db.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value) -> None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value))
+        )
+
+    def _upsert(self, items: list[dict]) -> None:
+        self._db.executemany(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    x["id"],
+                    x["name"],
+                    x["mimeType"],
+                    (x.get("parents") or [None])[0],
+                    x.get("modifiedTime"),
+                    int(x["size"]) if x.get("size") else None,
+                )
+                for x in items
+            ],
+        )
+
+    def _full_sync(self, service) -> None:
+        token = (
+            service.changes()
+            .getStartPageToken(driveId=self.drive_id, supportsAllDrives=True)
+            .execute()["startPageToken"]
+        )
+        self._db.execute("DELETE FROM files")
+        page_token = None
+        while True:
+            results = (
+                service.files()
+                .list(
+                    q="trashed = false",
+                    fields=f"nextPageToken, files({self.FILE_FIELDS})",
+                    pageSize=1000,
+                    driveId=self.drive_id,
+                    includeItemsFromAllDrives=True,
+                    supportsAllDrives=True,
+                    corpora="drive",
+                    pageToken=page_token,
+                )
+                .execute()
+            )
+            self._upsert(results.get("files", []))
+            page_token = results.get("nextPageToken")
+            if page_token is None:
+                break
+        self._set_meta("page_token", token)
+
+    def _apply_changes(self, service, page_token: str) -> None:
+        while page_token:
+            results = (
+                service.changes()
+                .list(
+                    pageToken=page_token,
+                    fields=(
+                        "nextPageToken, newStartPageToken, "
+                        f"changes(fileId, removed, file({self.FILE_FIELDS}))"
+                    ),
+                    pageSize=1000,
+                    driveId=self.drive_id,
+                    includeItemsFromAllDrives=True,
+                    supportsAllDrives=True,
+                )
+                .execute()
+            )
+            changes = results.get("changes", [])
+            removed = [
+                (x["fileId"],)
+                for x in changes
+                if x.get("removed") or x.get("file", {}).get("trashed")
+            ]
+            self._db.executemany("DELETE FROM files WHERE id = ?", removed)
+            self._upsert(
+                [
+                    x["file"]
+                    for x in changes
+                    if "file" in x
+                    and not x.get("removed")
+                    and not x["file"].get("trashed")
+                ]
+            )
+            if "newStartPageToken" in results:
+                self._set_meta("page_token", results["newStartPageToken"])
+            page_token = results.get("nextPageToken")
+
+    def sync(self, force: bool = False) -> bool:
+        """
+        brings the index up to date, unless it was synced within max_age seconds;
+        returns whether it synced
+        """
+        with self._lock:
+            synced_at = self._get_meta("synced_at")
+            if (
+                not force
+                and synced_at
+                and time.time() - float(synced_at) < self.max_age
+            ):
+                return False
+            service = self.service or get_service()
+            page_token = self._get_meta("page_token")
+            try:
+                with self._db:
+                    if page_token is None:
+                        self._full_sync(service)
+                    else:
+                        self._apply_changes(service, page_token)
+                    self._set_meta("synced_at", time.time())
+            except HttpError as error:
+                if page_token is None or error.resp.status not in (400, 404, 410):
+                    raise
+                # expired page token, start over with a full listing
+                with self._db:
+                    self._full_sync(service)
+                    self._set_meta("synced_at", time.time())
+            return True
+
+    def _find(self, folder_id: str, name: str) -> str | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id FROM files WHERE parent = ? AND name = ? "
+                "ORDER BY modified DESC LIMIT 1",
+                (folder_id, name),
+            ).fetchone()
+        return row[0] if row else None
+
+    def find(self, folder_id: str, name: str, verify: bool = True) -> str | None:
+        """
+        id of the (most recently modified) file called name in the folder. A hit
+        from an index synced within max_age is checked against the changes feed
+        (one changes.list call) unless verify=False: a file replaced under the
+        same name would otherwise resolve to the old, trashed id.
+        """
+        synced = self.sync()
+        file_id = self._find(folder_id, name)
+        if file_id is not None and verify and not synced:
+            self.sync(force=True)
+            file_id = self._find(folder_id, name)
+        return file_id
+
+    def list_folder(self, folder_id: str) -> dict:
+        """folder contents as {name: {"id", "type"}}, like list_files_in_folder"""
+        self.sync()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT name, id, mime_type FROM files WHERE parent = ? "
+                "ORDER BY modified",
+                (folder_id,),
+            ).fetchall()
+        return {name: {"id": id_, "type": mime_type} for name, id_, mime_type in rows}
+
+    def resolve(self, path: str, root: str | None = None) -> str | None:
+        """id of "folder/subfolder/file.xlsx" relative to root (the drive by default)"""
+        self.sync(force=True)
+        file_id = root or self.drive_id
+        for name in [x for x in path.strip("/").split("/") if x]:
+            file_id = self.find(file_id, name, verify=False)
+            if file_id is None:
+                return None
+        return file_id
+
+    def file_path(self, file_id: str) -> str | None:
+        """path of a file from the drive root"""
+        self.sync()
+        names = []
+        with self._lock:
+            while file_id and file_id != self.drive_id:
+                row = self._db.execute(
+                    "SELECT name, parent FROM files WHERE id = ?", (file_id,)
+                ).fetchone()
+                if row is None:
+                    return None
+                names.append(row[0])
+                file_id = row[1]
+        return "/".join(reversed(names))
+
+
+def get_index(drive_id: str) -> DriveIndex:
+    """DriveIndex of the shared drive, opened once per process"""
+    with _lock:
+        if drive_id not in _indexes:
+            _indexes[drive_id] = DriveIndex(drive_id)
+        return _indexes[drive_id]
+
+
 def find_file_id(folder_id, drive_id, filename):
-    result = list_files_in_folder(folder_id, drive_id)
-    return result.get(filename, {}).get("id")
+    file_id = get_index(drive_id).find(folder_id, filename)
+    if file_id is None:
+        # created since the last sync
+        result = list_files_in_folder(folder_id, drive_id)
+        file_id = result.get(filename, {}).get("id")
+    return file_id
 
 
-def upload_file(file_path, parent_folder_id, service=connect()):
+def upload_file(file_path, parent_folder_id, service=None):
+    service = service or get_service()
     try:
         file_metadata = {
             "name": os.path.basename(file_path),
@@ -199,7 +491,8 @@ def upload_file(file_path, parent_folder_id, service=connect()):
         return None
 
 
-def create_file(file_bytes, file_name, parent_folder, mimetype=None, service=connect()):
+def create_file(file_bytes, file_name, parent_folder, mimetype=None, service=None):
+    service = service or get_service()
     file_metadata = {"name": file_name, "parents": [parent_folder]}
     media = MediaIoBaseUpload(file_bytes, mimetype=mimetype, resumable=True)
 
@@ -218,7 +511,8 @@ def create_file(file_bytes, file_name, parent_folder, mimetype=None, service=con
     return
 
 
-def replace_file(file_id, new_file_bytes, mimetype, service=connect()):
+def replace_file(file_id, new_file_bytes, mimetype, service=None):
+    service = service or get_service()
     media = MediaIoBaseUpload(new_file_bytes, mimetype=mimetype, resumable=True)
 
     updated_file = (
@@ -230,22 +524,274 @@ def replace_file(file_id, new_file_bytes, mimetype, service=connect()):
     print("File updated with ID: {}".format(updated_file.get("id")))
 
 
-def download_file(file_id, service=connect()):
-    # Request the file
-    request = service.files().get_media(fileId=file_id)
+def _print_progress(done, total):
+    print(f"Download {int(done / total * 100) if total else 100}%.")
+
+
+def download_file(
+    file_id,
+    service=None,
+    sink=None,
+    spool: bool = False,
+    chunk_size: int = TRANSFER_CHUNK_SIZE,
+):
+    """
+    Downloads a Drive file chunk by chunk and returns it positioned at the start.
+
+    Args:
+        sink: writable file-like object to stream into instead of a BytesIO
+        spool: stream into a SpooledTemporaryFile that moves to disk once it
+            exceeds SPOOL_MAX_MEMORY, so large files aren't held in memory
+        chunk_size: bytes per request
+    """
+    service = service or get_service()
+    request = service.files().get_media(fileId=file_id, supportsAllDrives=True)
+    if sink is None:
+        sink = (
+            tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+            if spool
+            else BytesIO()
+        )
+    _download_chunks(request, sink, chunk_size=chunk_size, progress=_print_progress)
+    try:
+        sink.seek(0)
+    except (AttributeError, UnsupportedOperation):
+        pass  # not seekable, e.g. a pipe or socket
+    return sink
+
 
-    # Create a BytesIO object to receive the file content
-    buf = BytesIO()
-    downloader = MediaIoBaseDownload(buf, request)
+def read_csv_chunks(
+    file_id,
+    chunksize: int = 100_000,
+    chunk_size: int = TRANSFER_CHUNK_SIZE,
+    **kwargs,
+):
+    """
+    Yields a Drive CSV file as DataFrames of chunksize rows while it downloads.
+    A producer thread writes the downloaded chunks into a pipe that pd.read_csv
+    reads from, so the whole file is never held in memory.
+    kwargs are passed to pd.read_csv.
+    """
+    read_fd, write_fd = os.pipe()
+    errors = []
 
+    def produce():
+        pipe = os.fdopen(write_fd, "wb")
+        try:
+            # own client, httplib2 connections can't be shared between threads
+            request = (
+                connect().files().get_media(fileId=file_id, supportsAllDrives=True)
+            )
+            _download_chunks(request, pipe, chunk_size=chunk_size)
+        except BrokenPipeError:
+            pass  # the reader stopped early
+        except Exception as error:
+            # recorded before the pipe closes, so the reader sees it at EOF
+            errors.append(error)
+        finally:
+            try:
+                pipe.close()
+            except BrokenPipeError:
+                pass
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    # each chunk is held back until the next one is parsed, so a download that
+    # fails partway never yields the truncated rows of the last chunk
+    pending = None
+    with os.fdopen(read_fd, "rb") as pipe:
+        try:
+            with pd.read_csv(pipe, chunksize=chunksize, **kwargs) as reader:
+                for chunk in reader:
+                    if pending is not None:
+                        yield pending
+                    pending = chunk
+        except (pd.errors.EmptyDataError, pd.errors.ParserError):
+            producer.join()
+            if not errors:
+                raise
+    producer.join()
+    if errors:
+        raise errors[0]
+    if pending is not None:
+        yield pending
+
+
+def _download_chunks(
+    request, sink, chunk_size=TRANSFER_CHUNK_SIZE, num_retries=0, progress=None
+):
+    """
+    Downloads a media request into any writable file-like sink chunk by chunk,
+    calling progress(bytes done, total bytes) after each chunk.
+    """
+    downloader = MediaIoBaseDownload(sink, request, chunksize=chunk_size)
     done = False
     while not done:
-        status, done = downloader.next_chunk()
-        print(f"Download {int(status.progress() * 100)}%.")
+        status, done = downloader.next_chunk(num_retries=num_retries)
+        if progress and status:
+            progress(status.resumable_progress, status.total_size)
+    return sink
 
-    # Write the content to a file
-    buf.seek(0)
-    return buf
+
+class TransferManager:
+    """
+    Parallel Drive downloads and uploads. Every worker thread gets its own
+    authorized httplib2 connection and Drive client (httplib2 isn't thread-safe),
+    transfers run in chunk_size requests, and failed transfers are retried with
+    exponential backoff.
+
+    Args:
+        max_workers: transfers running at the same time
+        chunk_size: bytes per request, a multiple of 256 KB
+        retries: retries per chunk (done by googleapiclient) and per transfer
+        progress: optional callback(name, bytes done, total bytes), called from
+            the worker threads
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 8,
+        chunk_size: int = TRANSFER_CHUNK_SIZE,
+        retries: int = 5,
+        progress=None,
+    ):
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.progress = progress
+        self._local = threading.local()
+
+    def _service(self):
+        """Drive client of the calling thread"""
+        if getattr(self._local, "service", None) is None:
+            http = AuthorizedHttp(get_credentials(), http=httplib2.Http())
+            self._local.service = build(
+                "drive", "v3", http=http, static_discovery=True, cache_discovery=False
+            )
+        return self._local.service
+
+    def _progress(self, name):
+        if self.progress is None:
+            return None
+        return lambda done, total: self.progress(name, done, total)
+
+    def _retry(self, transfer, *args):
+        for attempt in range(self.retries + 1):
+            try:
+                return transfer(*args)
+            except (HttpError, httplib2.HttpLib2Error, OSError) as error:
+                status = getattr(getattr(error, "resp", None), "status", None)
+                if attempt == self.retries or (
+                    isinstance(error, HttpError) and status not in RETRY_STATUSES
+                ):
+                    raise
+                # a broken connection is replaced on the next attempt
+                self._local.service = None
+                time.sleep(min(2**attempt, 60) + random.random())
+
+    def _download(self, file_id, sink):
+        if hasattr(sink, "seek"):
+            sink.seek(0)
+            sink.truncate()
+        request = (
+            self._service().files().get_media(fileId=file_id, supportsAllDrives=True)
+        )
+        return _download_chunks(
+            request,
+            sink,
+            chunk_size=self.chunk_size,
+            num_retries=self.retries,
+            progress=self._progress(file_id),
+        )
+
+    def download(self, file_id, sink=None):
+        """downloads one file into sink (a new BytesIO by default) and returns it"""
+        sink = BytesIO() if sink is None else sink
+        self._retry(self._download, file_id, sink)
+        sink.seek(0)
+        return sink
+
+    def _download_to_folder(self, file_id, folder, name=None):
+        if name is None:
+            name = (
+                self._service()
+                .files()
+                .get(fileId=file_id, fields="name", supportsAllDrives=True)
+                .execute()["name"]
+            )
+        path = os.path.join(folder, name)
+        with open(path, "wb") as f:
+            self._retry(self._download, file_id, f)
+        return path
+
+    def download_many(self, file_ids, folder=None) -> dict:
+        """
+        Downloads files in parallel.
+
+        Args:
+            file_ids: list of ids, or {id: file name} to name the saved files
+            folder: save the files there and return their paths; without it
+                every file is returned as a BytesIO
+
+        Returns {file id: BytesIO / path}, None for files that failed.
+        """
+        names = file_ids if isinstance(file_ids, dict) else {}
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        def transfer(file_id):
+            try:
+                if folder:
+                    return self._download_to_folder(file_id, folder, names.get(file_id))
+                return self.download(file_id)
+            except Exception as error:
+                print(f"An error occurred while downloading {file_id}: {error}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return dict(zip(file_ids, executor.map(transfer, list(file_ids))))
+
+    def _upload(self, file_path, parent_folder_id):
+        media = MediaFileUpload(file_path, chunksize=self.chunk_size, resumable=True)
+        request = (
+            self._service()
+            .files()
+            .create(
+                body={
+                    "name": os.path.basename(file_path),
+                    "parents": [parent_folder_id],
+                },
+                media_body=media,
+                fields="id",
+                supportsAllDrives=True,
+            )
+        )
+        progress = self._progress(file_path)
+        response = None
+        while response is None:
+            status, response = request.next_chunk(num_retries=self.retries)
+            if progress and status:
+                progress(status.resumable_progress, status.total_size)
+        if progress:
+            progress(media.size(), media.size())
+        return response
+
+    def upload(self, file_path, parent_folder_id) -> dict:
+        """resumable chunked upload of one file, returns {"id": ...}"""
+        return self._retry(self._upload, file_path, parent_folder_id)
+
+    def upload_many(self, file_paths: list, parent_folder_id) -> dict:
+        """uploads files in parallel, returns {path: {"id": ...}}, None for failures"""
+
+        def transfer(file_path):
+            try:
+                return self.upload(file_path, parent_folder_id)
+            except Exception as error:
+                print(f"An error occurred while uploading {file_path}: {error}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return dict(zip(file_paths, executor.map(transfer, file_paths)))
 
 
 def upload_folder(service, folder_path, parent_folder_id, drive_id):
@@ -269,7 +815,7 @@ def upload_folder(service, folder_path, parent_folder_id, drive_id):
         for item in os.listdir(folder_path):
             item_path = os.path.join(folder_path, item)
             if os.path.isfile(item_path):
-                upload_file(service, item_path, folder["id"], drive_id)
+                upload_file(item_path, folder["id"], service=service)
             elif os.path.isdir(item_path):
                 upload_folder(service, item_path, folder["id"], drive_id)
 
@@ -279,7 +825,7 @@ def upload_folder(service, folder_path, parent_folder_id, drive_id):
         return None
 
 
-def create_google_doc(title, parent_folder_id, content, service=connect()):
+def create_google_doc(title, parent_folder_id, content, service=None):
     """
     Creates a Google Doc in the specified folder with the given title and content.
 
@@ -287,11 +833,12 @@ def create_google_doc(title, parent_folder_id, content, service=connect()):
         title: The title of the new Google Doc.
         parent_folder_id: The ID of the parent folder.
         content: The text content to put in the document.
-        service: The Google Drive API service instance.
+        service: The Google Drive API service instance, the cached one if None.
 
     Returns:
         The created file object (including ID) or None if an error occurred.
     """
+    service = service or get_service()
     try:
         file_metadata = {
             "name": title,
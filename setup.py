@@ -17,7 +17,7 @@ setup(
         "openpyxl",
         "python-dotenv",
         "pandas",
-        "pandas-gbq",
+        "pyarrow",
         "tkcalendar",
         "xlsxwriter",
     ],
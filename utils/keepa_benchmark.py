@@ -0,0 +1,83 @@
+"""
+Reproducible timings of the KeepaProduct pipeline over recorded Keepa payloads.
+
+Record payloads once (uses Keepa tokens):
+    python -m utils.keepa_benchmark record B01M16WBW1 B07XYZ1234
+Run offline, without network or tokens:
+    python -m utils.keepa_benchmark run
+"""
+
+import argparse
+import time
+
+import pandas as pd
+
+from utils import keepa_modules as km
+
+SCALES = [1, 100, 1000]
+
+
+def record(asins: list[str], folder: str | None = None, domain: str = "US") -> None:
+    backend = km.RecordingBackend(folder)
+    for start in range(0, len(asins), 100):
+        backend.query(asins[start : start + 100], domain=domain)
+
+
+def _time_method(payloads: list[dict], n: int, method: str, **kwargs) -> float:
+    start = time.perf_counter()
+    for i in range(n):
+        payload = payloads[i % len(payloads)]
+        product = km.KeepaProduct(payload["asin"])
+        product.data = [payload]
+        getattr(product, method)(**kwargs)
+    return time.perf_counter() - start
+
+
+def run(
+    folder: str | None = None, domain: str = "US", scales: list[int] = SCALES
+) -> pd.DataFrame:
+    """
+    Times generate_daily_sales, generate_monthly_summary and get_last_days for
+    each scale, cycling through the recorded ASINs to reach the number of products.
+    """
+    backend = km.ReplayBackend(folder)
+    payloads = backend.query(backend.asins(domain), domain=domain)
+    if not payloads:
+        raise BaseException(f"No recorded payloads found in {backend.folder}")
+    km.set_backend(backend)
+    methods = {
+        "generate_daily_sales": {"days": 360},
+        "generate_monthly_summary": {},
+        "get_last_days": {"days": 30},
+    }
+    results = []
+    try:
+        for n in scales:
+            for method, kwargs in methods.items():
+                seconds = _time_method(payloads, n, method, **kwargs)
+                results.append(
+                    {
+                        "method": method,
+                        "asins": n,
+                        "seconds": round(seconds, 3),
+                        "ms per asin": round(seconds / n * 1000, 2),
+                    }
+                )
+                print(results[-1])
+    finally:
+        km.set_backend(None)
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="KeepaProduct benchmarks")
+    parser.add_argument("mode", choices=["record", "run"])
+    parser.add_argument("asins", nargs="*")
+    parser.add_argument("--folder", default=None)
+    parser.add_argument("--domain", default="US")
+    parser.add_argument("--scales", nargs="*", type=int, default=SCALES)
+    args = parser.parse_args()
+    if args.mode == "record":
+        record(args.asins, folder=args.folder, domain=args.domain)
+    else:
+        print(run(folder=args.folder, domain=args.domain, scales=args.scales))
@@ -1,14 +1,273 @@
 import keepa
 import os
+from abc import ABC, abstractmethod
+import pickle
+import numpy as np
 from numpy import nan
 import pandas as pd
-import time
+
+from common import user_folder
+from utils import mellanni_modules as mm
 
 KEEPA_KEY = os.getenv("KEEPA_KEY")
+# keepa time is minutes since 2011-01-01, offset from the unix epoch
+KEEPA_EPOCH_MINUTES = 21564000
+COUPON_COLUMNS = ["% off", "$ off", "SNS %", "SNS $"]
+# product fields and keepa csv series used by the KeepaProduct pull chain
+PAYLOAD_FIELDS = [
+    "asin",
+    "title",
+    "brand",
+    "parentAsin",
+    "rootCategory",
+    "imagesCSV",
+    "variations",
+    "couponHistory",
+    "monthlySoldHistory",
+]
+HISTORY_SERIES = ["NEW", "LIGHTNING_DEAL", "SALES"]
+
+
+def keepa_minutes_to_datetime(keepa_times) -> np.ndarray:
+    """converts an array of keepa minutes to datetime64 in one operation"""
+    minutes = np.asarray(keepa_times, dtype="int64") + KEEPA_EPOCH_MINUTES
+    return (minutes * 60).astype("datetime64[s]").astype("datetime64[ns]")
+
+
+def _reshape_history(history, width: int) -> np.ndarray:
+    """reshape a flat keepa history list into (n, width) rows, dropping unknown times"""
+    rows = np.asarray(history, dtype="int64").ravel()
+    rows = rows[: len(rows) // width * width].reshape(-1, width)
+    return rows[rows[:, 0] != 0]
+
+
+def _coupon_frame(times: np.ndarray, discounts: np.ndarray) -> pd.DataFrame:
+    """
+    % off / $ off columns from decoded couponHistory discounts (discount, sns
+    discount). Negative values are % off, positive values are cents off.
+    """
+    perc_off = np.where(discounts < 0, discounts, 0)
+    money_off = np.where(discounts > 0, discounts / 100, 0)
+    return pd.DataFrame(
+        data=np.column_stack(
+            [perc_off[:, 0], money_off[:, 0], perc_off[:, 1], money_off[:, 1]]
+        ),
+        index=keepa_minutes_to_datetime(times),
+        columns=COUPON_COLUMNS,
+    )
+
+
+def _monthly_sold_frame(times: np.ndarray, units: np.ndarray) -> pd.DataFrame:
+    return pd.DataFrame(
+        data=units.reshape(-1, 1),
+        index=keepa_minutes_to_datetime(times),
+        columns=["monthlySoldMin"],
+    )
+
+
+def _series_arrays(data: dict, series: str) -> tuple[np.ndarray, np.ndarray]:
+    """
+    int32 keepa-minute times and float64 values of one keepa csv series, taken
+    from the raw arrays when present, otherwise from the df_* DataFrame.
+    """
+    if series in data and f"{series}_time" in data:
+        times = np.asarray(data[f"{series}_time"], dtype="datetime64[m]")
+        values = np.asarray(data[series], dtype="float64")
+    elif f"df_{series}" in data:
+        frame = data[f"df_{series}"]
+        times = frame.index.to_numpy(dtype="datetime64[m]")
+        values = frame.iloc[:, 0].to_numpy(dtype="float64")
+    else:
+        return np.empty(0, dtype="int32"), np.empty(0, dtype="float64")
+    minutes = times.astype("int64") - KEEPA_EPOCH_MINUTES
+    return minutes.astype("int32"), values
+
+
+_shared_indexes: dict[tuple, np.ndarray] = {}
+
+
+def _shared_index(index: np.ndarray) -> np.ndarray:
+    """returns one read-only copy per distinct index, so products covering the same days share it"""
+    if len(index) == 0:
+        return index
+    key = (index.dtype.str, index[0], index[-1], len(index))
+    shared = _shared_indexes.get(key)
+    if shared is None or not np.array_equal(shared, index):
+        shared = index.copy()
+        shared.setflags(write=False)
+        _shared_indexes[key] = shared
+    return shared
+
+
+class CompactFrame:
+    """
+    Numeric DataFrame kept as a float64 value matrix plus its labels (float64 so
+    rounded prices read back unchanged). Daily (datetime.date) indexes are stored
+    as a shared datetime64[D] array.
+    """
+
+    __slots__ = ("index", "index_name", "columns", "values", "dates")
+
+    def __init__(self, frame: pd.DataFrame):
+        self.dates: bool = len(frame) > 0 and not isinstance(
+            frame.index, pd.DatetimeIndex
+        )
+        index = frame.index.to_numpy()
+        if self.dates:
+            index = _shared_index(index.astype("datetime64[D]"))
+        self.index: np.ndarray = index
+        self.index_name = frame.index.name
+        self.columns: list = frame.columns.tolist()
+        self.values: np.ndarray = frame.to_numpy(dtype="float64")
+
+    def to_frame(self) -> pd.DataFrame:
+        index = self.index.astype(object) if self.dates else self.index
+        return pd.DataFrame(
+            self.values.copy(),
+            index=pd.Index(index, name=self.index_name),
+            columns=self.columns,
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes + (0 if self.dates else self.index.nbytes)
+
+
+def compact_payload(product: dict) -> dict:
+    """
+    Strips a keepa product down to the fields and raw numpy arrays used by the
+    pull chain, without the df_* DataFrames, so it is cheap to pickle or store.
+    """
+    data = product.get("data") or {}
+    payload = {key: product.get(key) for key in PAYLOAD_FIELDS}
+    payload["data"] = {
+        key: data[key]
+        for series in HISTORY_SERIES
+        for key in (series, f"{series}_time")
+        if key in data
+    }
+    return payload
+
+
+def expand_payload(payload: dict) -> dict:
+    """rebuilds the df_* DataFrames keepa creates from the raw arrays of a compact payload"""
+    data = dict(payload.get("data") or {})
+    for series in HISTORY_SERIES:
+        if series in data and f"{series}_time" in data:
+            data[f"df_{series}"] = pd.DataFrame(
+                {"value": data[series]}, index=data[f"{series}_time"]
+            )
+    return {**payload, "data": data}
+
+
+class KeepaBackend(ABC):
+    """Source of keepa product payloads used by this module."""
+
+    @abstractmethod
+    def query(self, asins, domain: str = "US", **kwargs) -> list[dict]: ...
+
+    @property
+    @abstractmethod
+    def tokens_left(self) -> int: ...
+
+
+class LiveBackend(KeepaBackend):
+    """Keepa API backend, connecting on first use rather than at import."""
+
+    def __init__(self, api_key: str | None = KEEPA_KEY):
+        self.api_key = api_key
+        self._api = None
+
+    @property
+    def api(self) -> keepa.Keepa:
+        if self._api is None:
+            self._api = keepa.Keepa(self.api_key)
+        return self._api
+
+    def query(self, asins, domain: str = "US", **kwargs) -> list[dict]:
+        return self.api.query(asins, domain=domain, **kwargs)
+
+    @property
+    def tokens_left(self) -> int:
+        return self.api.tokens_left
+
+
+class RecordingBackend(KeepaBackend):
+    """
+    Passes queries to another backend (live by default) and saves every returned
+    product as a compact payload to folder/<domain>/<asin>.pkl for later replay.
+    """
+
+    def __init__(self, folder: str | None = None, backend: KeepaBackend | None = None):
+        self.folder = folder or os.path.join(user_folder, "keepa_recordings")
+        self.backend = backend or LiveBackend()
+
+    def query(self, asins, domain: str = "US", **kwargs) -> list[dict]:
+        products = self.backend.query(asins, domain=domain, **kwargs)
+        domain_folder = os.path.join(self.folder, domain)
+        if not os.path.exists(domain_folder):
+            os.makedirs(domain_folder)
+        for product in products:
+            if not product.get("asin"):
+                continue
+            with open(os.path.join(domain_folder, f"{product['asin']}.pkl"), "wb") as f:
+                pickle.dump(compact_payload(product), f)
+        return products
+
+    @property
+    def tokens_left(self) -> int:
+        return self.backend.tokens_left
+
+
+class ReplayBackend(KeepaBackend):
+    """Serves payloads saved by RecordingBackend from local files, without network or tokens."""
+
+    def __init__(self, folder: str | None = None):
+        self.folder = folder or os.path.join(user_folder, "keepa_recordings")
+
+    def asins(self, domain: str = "US") -> list[str]:
+        domain_folder = os.path.join(self.folder, domain)
+        if not os.path.exists(domain_folder):
+            return []
+        return sorted(
+            x.removesuffix(".pkl")
+            for x in os.listdir(domain_folder)
+            if x.endswith(".pkl")
+        )
+
+    def query(self, asins, domain: str = "US", **kwargs) -> list[dict]:
+        if isinstance(asins, str):
+            asins = [asins]
+        products = []
+        for asin in asins:
+            path = os.path.join(self.folder, domain, f"{asin}.pkl")
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    products.append(expand_payload(pickle.load(f)))
+        return products
+
+    @property
+    def tokens_left(self) -> int:
+        return 0
+
+
+_backend: KeepaBackend | None = None
+
+
+def set_backend(backend: KeepaBackend | None) -> None:
+    """switch the payload source for KeepaProduct and the module functions (None resets to live)"""
+    global _backend
+    _backend = backend
+
+
+def get_backend() -> KeepaBackend:
+    global _backend
+    if _backend is None:
+        _backend = LiveBackend()
+    return _backend
 
 
 class KeepaProduct:
-    api = keepa.Keepa(KEEPA_KEY)
     # create sales ranges (min - max)
     sales_tiers: dict = {
         -1: 0,
@@ -44,6 +303,35 @@ class KeepaProduct:
         100000: 150000,
     }
 
+    __slots__ = (
+        "exists",
+        "asin",
+        "domain",
+        "title",
+        "image",
+        "data",
+        "brand",
+        "parent",
+        "category",
+        "initial_days",
+        "window_start",
+        "variations",
+        "variation_theme",
+        "variation_theme_dict",
+        "avg_price",
+        "last_sales_date",
+        "summary",
+        "min_sales",
+        "max_sales",
+        "avg_sales",
+        "full_price",
+        "_series",
+        "_pivot",
+        "_short_history",
+        "_sales_history_monthly",
+        "_last_days_start",
+    )
+
     def __init__(self, asin=None, domain="US"):
         self.exists: bool = False
         self.asin: str = input("ASIN?\n\n") if not asin else asin
@@ -53,10 +341,17 @@ class KeepaProduct:
         self.data: dict | None = None
         self.brand: str = None
         self.parent: str = None
-        self.pivot: pd.DataFrame | None = None
+        self.category: int | None = None
         self.initial_days: int = 360
+        self.window_start: pd.Timestamp | None = None
         self.variations = set()
         self.avg_price = 0
+        # decoded payload: series name -> (int32 keepa minutes, values)
+        self._series: dict[str, tuple[np.ndarray, np.ndarray]] | None = None
+        self._pivot: CompactFrame | None = None
+        self._short_history: CompactFrame | None = None
+        self._sales_history_monthly: CompactFrame | None = None
+        self._last_days_start = None
 
     def __ge__(self, other):
         return self.max_sales >= other.max_sales
@@ -79,6 +374,51 @@ class KeepaProduct:
             return f"{self.asin} does not exist or there is no Keepa data for it"
         return f"{self.asin}: {self.brand}\n{self.title}\nLatest {days} days sales: {self.min_sales:,.0f} - {self.max_sales:,.0f} units ({self.avg_sales:,.0f} average)\nAverage price last {days} days: \$ {self.avg_price:.2f}, total sales: \$ {(self.avg_sales*self.avg_price):,.0f}"
 
+    @property
+    def pivot(self) -> pd.DataFrame | None:
+        return None if self._pivot is None else self._pivot.to_frame()
+
+    @pivot.setter
+    def pivot(self, value: pd.DataFrame | None):
+        self._pivot = None if value is None else CompactFrame(value)
+
+    @property
+    def short_history(self) -> pd.DataFrame | None:
+        return None if self._short_history is None else self._short_history.to_frame()
+
+    @short_history.setter
+    def short_history(self, value: pd.DataFrame | None):
+        self._short_history = None if value is None else CompactFrame(value)
+
+    @property
+    def sales_history_monthly(self) -> pd.DataFrame | None:
+        if self._sales_history_monthly is None:
+            return None
+        return self._sales_history_monthly.to_frame()
+
+    @sales_history_monthly.setter
+    def sales_history_monthly(self, value: pd.DataFrame | None):
+        self._sales_history_monthly = None if value is None else CompactFrame(value)
+
+    @property
+    def last_days(self) -> pd.DataFrame | None:
+        if self._pivot is None or self._last_days_start is None:
+            return None
+        pivot = self.pivot
+        last_days = pivot[pivot.index >= self._last_days_start].copy()
+        last_days["asin"] = self.asin
+        return last_days
+
+    @property
+    def nbytes(self) -> int:
+        """approximate memory held by the decoded series and the compact frames"""
+        series = sum(
+            times.nbytes + values.nbytes
+            for times, values in (self._series or {}).values()
+        )
+        frames = [self._pivot, self._short_history, self._sales_history_monthly]
+        return series + sum(x.nbytes for x in frames if x is not None)
+
     def _format_numbers(self, df):
         if "full price" in df.columns:
             df["full price"] = round(df["full price"], 2)
@@ -95,18 +435,90 @@ class KeepaProduct:
     def query(self):
         if not self.data:
             try:
-                self.data = KeepaProduct.api.query(self.asin, domain=self.domain)
+                self.data = get_backend().query(self.asin, domain=self.domain)
             except Exception:
                 self.data = [{}]
 
+    def _decode(self):
+        """
+        Decodes the raw payload into int32 time / float64 value arrays per series
+        and drops it; DataFrames for the pull chain are built from these arrays
+        on demand.
+        """
+        if not self.data:
+            self.query()
+        if not self.data or self.data == "Not found":
+            self._series = {}
+            return
+        product = self.data[0]
+        self.title = product.get("title")
+        img_links = product.get("imagesCSV")
+        if img_links and len(img_links.split(",")) > 0:
+            self.image = (
+                "https://m.media-amazon.com/images/I/" + img_links.split(",")[0]
+            )
+        self.brand = product.get("brand")
+        self.parent = product.get("parentAsin")
+        self.category = product.get("rootCategory")
+        self.get_variations()
+
+        data = product.get("data") or {}
+        series = {}
+        for name in HISTORY_SERIES:
+            times, values = _series_arrays(data, name)
+            if len(times) > 0:
+                series[name] = (times, values)
+        for name, field, width in [
+            ("COUPONS", "couponHistory", 3),
+            ("MONTHLY_SOLD", "monthlySoldHistory", 2),
+        ]:
+            if product.get(field):
+                rows = _reshape_history(product[field], width)
+                series[name] = (rows[:, 0].astype("int32"), rows[:, 1:].astype("int32"))
+        self._series = series
+        self.exists = "NEW" in series
+        if self.exists:
+            self.last_sales_date = pd.Timestamp(
+                keepa_minutes_to_datetime(series["NEW"][0][-1:])[0]
+            )
+        self.data = None
+
+    def _windowed(self, name: str) -> tuple[np.ndarray, np.ndarray] | None:
+        """
+        Slices a decoded series to window_start, keeping the last point before the
+        window so that forward-fill still gives the correct starting values.
+        """
+        if name not in self._series:
+            return None
+        times, values = self._series[name]
+        if self.window_start is None:
+            return times, values
+        window_start = (
+            self.window_start.to_datetime64().astype("datetime64[m]").astype("int64")
+            - KEEPA_EPOCH_MINUTES
+        )
+        start = max(np.searchsorted(times, window_start, side="left") - 1, 0)
+        return times[start:], values[start:]
+
+    def _series_frame(self, name: str, column: str) -> pd.DataFrame | None:
+        series = self._windowed(name)
+        if series is None:
+            return None
+        times, values = series
+        return pd.DataFrame(
+            {column: values.astype("float64")},
+            index=keepa_minutes_to_datetime(times),
+        )
+
     def extract_from_products(self, products: list):
         self.data = [x for x in products if x["asin"] == self.asin]
+        self._series = None
 
     def convert_time(self, keepa_time: int) -> pd.Timestamp:
         """function that converts time from keepa format to datetime format"""
         if keepa_time == 0:
             return "unknown"
-        converted = (keepa_time + 21564000) * 60000
+        converted = (keepa_time + KEEPA_EPOCH_MINUTES) * 60000
         converted = pd.to_datetime(converted, unit="ms")
         return converted
 
@@ -117,73 +529,45 @@ class KeepaProduct:
         return KeepaProduct.sales_tiers[x]
 
     def get_variations(self):
+        if self._series is not None:
+            # payload already decoded, variations were parsed then
+            return
         if not self.data:
             self.query()
         if "variations" in self.data[0].keys() and self.data[0]["variations"]:
             self.variations.update([x["asin"] for x in self.data[0]["variations"]])
-            self.variation_theme_dict = [
-                theme["attributes"]
-                for theme in self.data[0]["variations"]
-                if theme["asin"] == self.asin
-            ][0]
+            self.variation_theme_dict = next(
+                (
+                    theme["attributes"]
+                    for theme in self.data[0]["variations"]
+                    if theme["asin"] == self.asin
+                ),
+                [],
+            )
             self.variation_theme = {
                 x["dimension"]: x["value"] for x in self.variation_theme_dict
             }
 
     def pull_sales(self):
-        if not self.data:
-            self.query()
-        elif self.data == "Not found":
-            return
-        self.title = self.data[0].get("title")
-        img_links = self.data[0].get("imagesCSV")
-        if img_links and len(img_links.split(",")) > 0:
-            self.image = (
-                "https://m.media-amazon.com/images/I/" + img_links.split(",")[0]
-            )
-        self.brand = self.data[0].get("brand")
-        self.parent = self.data[0].get("parentAsin")
-        sales = self.data[0].get("data", {}).get("df_NEW", pd.DataFrame())
-        if len(sales) > 0:
-            self.exists = True
-        else:
+        if self._series is None:
+            self._decode()
+        sales = self._series_frame("NEW", "full price")
+        if sales is None:
             return
-        sales = sales.rename(columns={"value": "full price"}).fillna(-1)
-        self.last_sales_date = sales.index[-1]
-        return sales
+        return sales.fillna(-1)
 
     def pull_coupons(self):
         sales = self.pull_sales()
         if not self.exists:
             return
-        coupons = self.data[0].get("couponHistory")
+        coupons = self._windowed("COUPONS")
         if coupons:
-            times = [self.convert_time(x) for x in coupons[::3]]
-            discounts = coupons[1::3]
-            perc_off = [
-                x if x < 0 else 0 for x in discounts
-            ]  # separate % off discounts
-            money_off = [
-                x / 100 if x > 0 else 0 for x in discounts
-            ]  # separate $ off discounts
-            sns_coupons = coupons[2::3]
-            sns_perc_off = [
-                x if x < 0 else 0 for x in sns_coupons
-            ]  # separate % off sns
-            sns_money_off = [
-                x / 100 if x > 0 else 0 for x in sns_coupons
-            ]  # separate $ off sns
-
-            coupon_history = pd.DataFrame(
-                data=list(zip(perc_off, money_off, sns_perc_off, sns_money_off)),
-                index=times,
-                columns=["% off", "$ off", "SNS %", "SNS $"],
-            )
+            coupon_history = _coupon_frame(*coupons)
         else:
             coupon_history = pd.DataFrame(
                 [[0, 0, 0, 0]],
                 index=[self.last_sales_date],
-                columns=["% off", "$ off", "SNS %", "SNS $"],
+                columns=COUPON_COLUMNS,
             )
 
         sales_history = pd.merge(
@@ -195,16 +579,10 @@ class KeepaProduct:
         sales_history = self.pull_coupons()
         if not self.exists:
             return
-        lds = (
-            self.data[0]
-            .get("data", {})
-            .get(
-                "df_LIGHTNING_DEAL",
-                pd.DataFrame([0], index=[self.last_sales_date], columns=["LD"]),
-            )
-        )
+        lds = self._series_frame("LIGHTNING_DEAL", "LD")
+        if lds is None:
+            lds = pd.DataFrame([0], index=[self.last_sales_date], columns=["LD"])
         lds = lds.fillna(0)
-        lds = lds.rename(columns={"value": "LD"})
 
         sales_history = (
             pd.merge(sales_history, lds, how="outer", left_index=True, right_index=True)
@@ -217,16 +595,10 @@ class KeepaProduct:
         sales_history = self.pull_lds()
         if not self.exists:
             return
-        bsr = (
-            self.data[0]
-            .get("data", {})
-            .get(
-                "df_SALES",
-                pd.DataFrame([nan], index=[self.last_sales_date], columns=["BSR"]),
-            )
-            .replace(-1, nan)
-        )
-        bsr = bsr.rename(columns={"value": "BSR"})
+        bsr = self._series_frame("SALES", "BSR")
+        if bsr is None:
+            bsr = pd.DataFrame([nan], index=[self.last_sales_date], columns=["BSR"])
+        bsr = bsr.replace(-1, nan)
         sales_history = pd.merge(
             sales_history, bsr, how="outer", left_index=True, right_index=True
         ).ffill()
@@ -247,13 +619,9 @@ class KeepaProduct:
         sales_history = self.pull_bsr()
         if not self.exists:
             return
-        monthly_sold = self.data[0].get("monthlySoldHistory")
+        monthly_sold = self._windowed("MONTHLY_SOLD")
         if monthly_sold:
-            times = [self.convert_time(x) for x in monthly_sold[::2]]
-            monthly_units = monthly_sold[1::2]
-            monthly_sold_history = pd.DataFrame(
-                data=monthly_units, index=times, columns=["monthlySoldMin"]
-            )
+            monthly_sold_history = _monthly_sold_frame(*monthly_sold)
         else:
             monthly_sold_history = pd.DataFrame(
                 [-1], index=[self.last_sales_date], columns=["monthlySoldMin"]
@@ -263,37 +631,38 @@ class KeepaProduct:
         ].map(KeepaProduct.sales_tiers)
         monthly_sold_history = monthly_sold_history.replace(-1, 0)
 
-        self.sales_history_monthly = pd.merge(
+        sales_history_monthly = pd.merge(
             sales_history,
             monthly_sold_history,
             how="outer",
             left_index=True,
             right_index=True,
         ).ffill()
-        return self.sales_history_monthly
+        self.sales_history_monthly = sales_history_monthly
+        return sales_history_monthly
 
     def generate_daily_sales(self, days=360):
-        self.short_history = self.pull_monthly_sold()
+        # push the window down so every pull_* stage only merges the requested days
+        self.window_start = pd.Timestamp(
+            (pd.to_datetime("today") - pd.Timedelta(days=days)).date()
+        )
+        short_history = self.pull_monthly_sold()
         if not self.exists:
             return
-        self.short_history["sales min"] = self.short_history["monthlySoldMin"] / (
-            60 * 24 * 30
-        )
-        self.short_history["sales max"] = self.short_history["monthlySoldMax"] / (
-            60 * 24 * 30
-        )
+        short_history["sales min"] = short_history["monthlySoldMin"] / (60 * 24 * 30)
+        short_history["sales max"] = short_history["monthlySoldMax"] / (60 * 24 * 30)
 
-        # lifetime = pd.date_range(self.short_history.index.min(), self.short_history.index.max(), freq='min')
+        # lifetime = pd.date_range(short_history.index.min(), short_history.index.max(), freq='min')
         lifetime = pd.date_range(
-            (pd.to_datetime("today") - pd.Timedelta(days=days)).date(),
-            self.short_history.index.max(),
+            self.window_start,
+            short_history.index.max(),
             freq="min",
         )
 
         lifetime_df = pd.DataFrame(index=lifetime)
         minutely_history = pd.merge(
             lifetime_df,
-            self.short_history,
+            short_history,
             how="left",
             left_index=True,
             right_index=True,
@@ -303,21 +672,19 @@ class KeepaProduct:
         minutely_history["full price"] = minutely_history["full price"].replace(-1, nan)
 
         # trim minutely history into short history
-        self.short_history = minutely_history.copy()
-        sum_cols = self.short_history.columns
-        self.short_history["sum1"] = self.short_history[sum_cols].sum(axis=1)
-        self.short_history["sum2"] = self.short_history[sum_cols].shift(-1).sum(axis=1)
-        self.short_history["sum3"] = self.short_history[sum_cols].shift(1).sum(axis=1)
-
-        self.short_history["diff"] = (
-            self.short_history["sum1"] - self.short_history["sum2"]
-        ) + (self.short_history["sum1"] - self.short_history["sum3"])
-        self.short_history = self.short_history[self.short_history["diff"] != 0][
-            sum_cols
-        ]
+        short_history = minutely_history.copy()
+        sum_cols = short_history.columns
+        short_history["sum1"] = short_history[sum_cols].sum(axis=1)
+        short_history["sum2"] = short_history[sum_cols].shift(-1).sum(axis=1)
+        short_history["sum3"] = short_history[sum_cols].shift(1).sum(axis=1)
+
+        short_history["diff"] = (short_history["sum1"] - short_history["sum2"]) + (
+            short_history["sum1"] - short_history["sum3"]
+        )
+        short_history = short_history[short_history["diff"] != 0][sum_cols]
 
         minutely_history["date"] = minutely_history.index.date
-        self.pivot = minutely_history.pivot_table(
+        pivot = minutely_history.pivot_table(
             values=[
                 "full price",
                 "% off",
@@ -344,13 +711,11 @@ class KeepaProduct:
                 "BSR": "min",
             },
         )
-        if "full price" not in self.pivot.columns:
-            self.pivot["full price"] = nan
-        self.short_history["LD"] = self.short_history["LD"].replace(0, nan)
-        self.short_history["full price"] = self.short_history["full price"].replace(
-            -1, nan
-        )
-        self.short_history["coupon"] = (
+        if "full price" not in pivot.columns:
+            pivot["full price"] = nan
+        short_history["LD"] = short_history["LD"].replace(0, nan)
+        short_history["full price"] = short_history["full price"].replace(-1, nan)
+        short_history["coupon"] = (
             (
                 minutely_history["full price"]
                 - minutely_history["$ off"]
@@ -359,17 +724,26 @@ class KeepaProduct:
             * (1 + minutely_history["% off"] / 100)
             * (1 + minutely_history["SNS %"] / 100)
         )
-        self.short_history.loc[
-            self.short_history["coupon"] == self.short_history["full price"], "coupon"
+        short_history.loc[
+            short_history["coupon"] == short_history["full price"], "coupon"
         ] = nan
-        self.pivot = self._format_numbers(self.pivot)
-        self.pivot = self.pivot.replace(0, nan)
+        self.short_history = short_history
+        pivot = self._format_numbers(pivot)
+        self.pivot = pivot.replace(0, nan)
 
-    def generate_monthly_summary(self):
-        if not self.data:
+    def generate_monthly_summary(self, store: "KeepaHistoryStore | None" = None):
+        """
+        Summarizes the daily pivot by month. If a KeepaHistoryStore is passed,
+        only the missing days are pulled from Keepa and the full stored history is used.
+        """
+        if store is not None:
+            store.refresh(self.asin, initial_days=self.initial_days)
+            self.pivot = store.load(self.asin)
+            self.exists = self._pivot is not None
+        elif self._pivot is None:
             self.generate_daily_sales(days=self.initial_days)
-        if self.data and isinstance(self.pivot, pd.DataFrame):
-            summary = self.pivot.copy()
+        if self._pivot is not None:
+            summary = self.pivot
             summary = summary[summary.index >= pd.to_datetime("2020-01-01").date()]
             summary["year-month"] = (
                 pd.to_datetime(summary.index).year.astype(str)
@@ -398,69 +772,673 @@ class KeepaProduct:
         self.generate_daily_sales(days=days)
         if not self.exists:
             return
-        self.last_days = self.pivot[
-            self.pivot.index
-            >= (pd.to_datetime("today") - pd.Timedelta(days=days)).date()
-        ]
-        self.last_days["asin"] = self.asin
-        self.min_sales = int(self.last_days["sales min"].sum())
-        self.max_sales = int(self.last_days["sales max"].sum())
+        self._last_days_start = (
+            pd.to_datetime("today") - pd.Timedelta(days=days)
+        ).date()
+        last_days = self.last_days
+        self.min_sales = int(last_days["sales min"].sum())
+        self.max_sales = int(last_days["sales max"].sum())
         self.avg_sales = (self.min_sales + self.max_sales) / 2
-        self.full_price = self.last_days["full price"].mean()
-        if "final price" in self.last_days.columns:
-            self.avg_price = self.last_days["final price"].mean()
+        self.full_price = last_days["full price"].mean()
+        if "final price" in last_days.columns:
+            self.avg_price = last_days["final price"].mean()
+
+
+def _without_prices(product: dict) -> bool:
+    return not len(_series_arrays(product.get("data") or {}, "NEW")[0])
+
+
+# stored pivot column holding the value of each keepa csv series
+SEED_COLUMNS = {"NEW": "full price", "SALES": "BSR", "LIGHTNING_DEAL": "LD"}
+
 
+def _seed_series(product: dict, since, last_row: pd.Series) -> dict:
+    """
+    Payload where each csv series without points up to since (keepa drops the
+    points before the queried days) starts with a point at since, valued from
+    the stored pivot row of that day.
+    """
+    data = dict(product.get("data") or {})
+    start = np.datetime64(pd.Timestamp(since), "m")
+    for series, column in SEED_COLUMNS.items():
+        times, values = _series_arrays(data, series)
+        times = (times.astype("int64") + KEEPA_EPOCH_MINUTES).astype("datetime64[m]")
+        if len(times) and times[0] <= start:
+            continue
+        data.pop(f"df_{series}", None)
+        data[series] = np.concatenate([[last_row[column]], values])
+        data[f"{series}_time"] = np.concatenate([[start], times])
+    return {**product, "data": data}
 
-def get_products(asins: list, domain="US", update=None):
-    api = keepa.Keepa(KEEPA_KEY)
-    products = api.query(asins, domain=domain, update=update)
+
+def get_products(asins: list, domain="US", update=None, days=None, requery=True):
+    """
+    With days, keepa drops the points before the last days, so a product whose
+    price has not changed in that range comes back without prices: those are
+    queried again in full unless requery=False.
+    """
+    products = get_backend().query(asins, domain=domain, update=update, days=days)
+    if days and requery:
+        unchanged = [
+            x["asin"] for x in products if x.get("asin") and _without_prices(x)
+        ]
+        if unchanged:
+            full = get_backend().query(unchanged, domain=domain, update=update)
+            full = {x.get("asin"): x for x in full}
+            products = [full.get(x.get("asin"), x) for x in products]
     return products
 
 
 def get_tokens(api_key=KEEPA_KEY):
-    api = keepa.Keepa(api_key)
-    return api.tokens_left
+    if api_key == KEEPA_KEY:
+        return get_backend().tokens_left
+    return LiveBackend(api_key).tokens_left
+
+
+def _latest_value(values) -> float:
+    """last non-nan value of a keepa series array"""
+    values = np.asarray(values if values is not None else [], dtype="float64")
+    values = values[~np.isnan(values)]
+    return values[-1] if len(values) else nan
+
+
+def get_bulk_product_details(
+    asins: list[str], domain: str = "US", chunk_size: int = 100
+) -> pd.DataFrame:
+    """
+    Pulls product details for any number of ASINs in chunked Keepa batches.
+    Returns one row per ASIN; products that fail to parse (or are not returned)
+    keep their row with the reason in the "error" column instead of failing the batch.
+    """
+    fields = [
+        "asin",
+        "brand",
+        "title",
+        "bulletpoints",
+        "description",
+        "full price",
+        "coupon",
+        "monthly sales",
+        "image",
+        "error",
+    ]
+    columns = {x: [] for x in fields}
+
+    def add_row(**row):
+        for field in fields:
+            columns[field].append(row.get(field))
+
+    for start in range(0, len(asins), chunk_size):
+        chunk = asins[start : start + chunk_size]
+        try:
+            products = get_products(chunk, domain=domain)
+        except Exception as e:
+            for asin in chunk:
+                add_row(asin=asin, error=f"query failed: {e}")
+            continue
+        returned = set()
+        for p in products:
+            asin = p.get("asin")
+            returned.add(asin)
+            try:
+                img_links = p.get("imagesCSV")
+                coupon = p.get("coupon")
+                add_row(
+                    asin=asin,
+                    brand=p.get("brand"),
+                    title=p.get("title"),
+                    bulletpoints="\n".join(p.get("features") or []),
+                    description=p.get("description"),
+                    **{
+                        "full price": _latest_value((p.get("data") or {}).get("NEW")),
+                        "coupon": coupon[0] if coupon else 0,
+                        "monthly sales": p.get("monthlySold") or 0,
+                        "image": (
+                            "https://m.media-amazon.com/images/I/"
+                            + img_links.split(",")[0]
+                            if img_links
+                            else None
+                        ),
+                    },
+                )
+            except Exception as e:
+                add_row(asin=asin, error=str(e))
+        for asin in chunk:
+            if asin not in returned:
+                add_row(asin=asin, error="not found")
+
+    details = pd.DataFrame(columns)
+    price = details["full price"].astype("float64").to_numpy()
+    coupon = details["coupon"].fillna(0).astype("float64").to_numpy()
+    # negative coupons are % off, positive coupons are cents off
+    details["discount"] = np.where(
+        coupon < 0,
+        np.round(price * coupon / 100, 2),
+        np.where(coupon > 0, -coupon / 100, 0),
+    )
+    details["final price"] = (price + details["discount"]).round(2)
+    return details.drop(columns="coupon")
 
 
 def get_product_details(asins: list[str]):
-    api = keepa.Keepa(KEEPA_KEY)
-    tokens = api.tokens_left
-    if tokens < len(asins):
-        print("Please wait, not enough tokens to pull data from Amazon")
-        time.sleep(20)
-    products = api.query(asins)
-    items = {}
-    for p in products:
-        asin = p.get("asin")
-        brand = p.get("brand")
-        items[asin] = {}
-        title = p.get("title")
-        bulletpoints = p.get("features")
-        description = p.get("description")
-        price = p.get("data").get("df_NEW").dropna().iloc[-1].values[0]
-        coupon = p.get("coupon")
-        if not coupon:
-            coupon = 0
+    details = get_bulk_product_details(asins)
+    details = details[details["error"].isnull()].set_index("asin")
+    return details[
+        [
+            "brand",
+            "title",
+            "bulletpoints",
+            "description",
+            "full price",
+            "discount",
+            "monthly sales",
+            "image",
+        ]
+    ].to_dict("index")
+
+
+class KeepaHistoryStore:
+    """
+    Local columnar store of KeepaProduct daily pivots, one parquet file per ASIN.
+    Refreshes pull only the days since the last stored date and append them.
+    """
+
+    # extra days requested from keepa so that the first refreshed day can be forward-filled
+    padding_days: int = 7
+
+    def __init__(self, folder: str | None = None, domain: str = "US"):
+        self.domain: str = domain
+        self.folder: str = folder or os.path.join(user_folder, "keepa_history", domain)
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+    def _path(self, asin: str) -> str:
+        return os.path.join(self.folder, f"{asin}.parquet")
+
+    def asins(self) -> list[str]:
+        return sorted(
+            x.removesuffix(".parquet")
+            for x in os.listdir(self.folder)
+            if x.endswith(".parquet") and not x.startswith("_")
+        )
+
+    def catalog(self) -> pd.DataFrame:
+        """asin-level details (brand, title, root category) of the stored products"""
+        path = os.path.join(self.folder, "_catalog.parquet")
+        if not os.path.exists(path):
+            return pd.DataFrame(columns=["brand", "title", "category"]).rename_axis(
+                "asin"
+            )
+        return pd.read_parquet(path)
+
+    def update_catalog(self, products: list["KeepaProduct"]) -> None:
+        records = pd.DataFrame(
+            [
+                {
+                    "asin": x.asin,
+                    "brand": x.brand,
+                    "title": x.title,
+                    "category": x.category,
+                }
+                for x in products
+            ]
+        ).set_index("asin")
+        catalog = self.catalog()
+        catalog = pd.concat([catalog[~catalog.index.isin(records.index)], records])
+        catalog.to_parquet(os.path.join(self.folder, "_catalog.parquet"))
+
+    def load(self, asin: str) -> pd.DataFrame | None:
+        path = self._path(asin)
+        if not os.path.exists(path):
+            return None
+        history = pd.read_parquet(path)
+        history.index = pd.Index(history.index.date, name="date")
+        return history
+
+    def load_all(self, asins: list[str] | None = None) -> pd.DataFrame:
+        """returns stored pivots of all (or selected) ASINs in long format with an "asin" column"""
+        histories = []
+        for asin in asins or self.asins():
+            history = self.load(asin)
+            if history is not None:
+                histories.append(history.assign(asin=asin))
+        if not histories:
+            return pd.DataFrame()
+        return mm.compact_frame(pd.concat(histories))
+
+    def last_date(self, asin: str):
+        history = self.load(asin)
+        if history is None or len(history) == 0:
+            return None
+        return history.index.max()
+
+    def append(self, asin: str, pivot: pd.DataFrame) -> None:
+        """appends new days to the stored pivot, replacing any overlapping days"""
+        history = self.load(asin)
+        if history is not None:
+            history = history[history.index < pivot.index.min()]
+            pivot = pd.concat([history, pivot])
+        pivot = pivot.copy()
+        pivot.index = pd.DatetimeIndex(pd.to_datetime(pivot.index), name="date")
+        pivot.to_parquet(self._path(asin))
+
+    def refresh(self, asins: list[str] | str, initial_days: int = 360) -> None:
+        """
+        Pulls only the delta since the last stored date for each ASIN (or initial_days
+        for new ASINs) and appends it to the store. ASINs needing the same window are
+        queried from Keepa in one batch.
+        """
+        if isinstance(asins, str):
+            asins = [asins]
+        today = pd.to_datetime("today").date()
+        windows, last_rows = {}, {}
+        for asin in asins:
+            history = self.load(asin)
+            if history is None or len(history) == 0:
+                days = initial_days
+            else:
+                last_rows[asin] = history.iloc[-1]
+                days = (today - history.index.max()).days
+            windows.setdefault((max(days, 1), asin in last_rows), []).append(asin)
+
+        for (days, stored), group in windows.items():
+            # keepa drops the points before the queried days: new ASINs are queried
+            # in full (same token cost), stored ones only for the delta, with the
+            # series unchanged since the last stored day seeded from that day
+            products = get_products(
+                group,
+                domain=self.domain,
+                days=days + self.padding_days if stored else None,
+                requery=False,
+            )
+            if stored:
+                products = [
+                    _seed_series(x, last_rows[x["asin"]].name, last_rows[x["asin"]])
+                    for x in products
+                    if x.get("asin") in last_rows
+                ]
+            refreshed = []
+            for asin in group:
+                product = KeepaProduct(asin, domain=self.domain)
+                product.extract_from_products(products)
+                if not product.data:
+                    continue
+                product.generate_daily_sales(days=days)
+                if product.exists:
+                    self.append(asin, product.pivot)
+                    refreshed.append(product)
+            if refreshed:
+                self.update_catalog(refreshed)
+
+
+class KeepaFamily:
+    """
+    Sales and price analysis across all variations of a parent ASIN.
+    All variations are fetched from Keepa in one batch and aggregated together.
+    """
+
+    summary_aggfunc: dict = {
+        "sales min": "sum",
+        "sales max": "sum",
+        "sales avg": "sum",
+        "revenue": "sum",
+        "full price": "mean",
+        "final price": "mean",
+        "BSR": "mean",
+    }
+
+    def __init__(self, asin: str, domain: str = "US", days: int = 30):
+        self.asin: str = asin
+        self.domain: str = domain
+        self.days: int = days
+        self.themes: pd.DataFrame | None = None
+        self.history: pd.DataFrame | None = None
+        self.price_pivot: pd.DataFrame | None = None
+        self.sales_pivot: pd.DataFrame | None = None
+        self.variation_summary: pd.DataFrame | None = None
+        self.dimension_summary: dict[str, pd.DataFrame] = {}
+        self.totals: pd.Series | None = None
+        # payload of self.asin fetched by get_themes, reused by pull_history
+        self._payload: dict | None = None
+
+    def get_themes(self) -> pd.DataFrame:
+        """table of variation ASINs and their theme dimensions (size, color etc.)"""
+        product = KeepaProduct(self.asin, domain=self.domain)
+        product.query()
+        payload = product.data[0] if product.data else {}
+        if payload.get("asin") == self.asin:
+            self._payload = payload
+        themes = {
+            x["asin"]: {a["dimension"]: a["value"] for a in x.get("attributes", [])}
+            for x in payload.get("variations") or []
+        }
+        if themes:
+            self.themes = pd.DataFrame.from_dict(themes, orient="index")
+            self.themes.index.name = "asin"
         else:
-            if coupon[0] < 0:
-                coupon = round(price * coupon[0] / 100, 2)
-            elif coupon[0] > 0:
-                coupon = -coupon[0] / 100
+            self.themes = pd.DataFrame(index=pd.Index([self.asin], name="asin"))
+        return self.themes
+
+    def pull_history(self) -> pd.DataFrame:
+        """batch-fetches all variations and collects their daily pivots in long format"""
+        if self.themes is None:
+            self.get_themes()
+        asins = self.themes.index.tolist()
+        fetched = {self.asin: self._payload} if self._payload else {}
+        missing = [x for x in asins if x not in fetched]
+        products = [fetched[x] for x in asins if x in fetched]
+        if missing:
+            products += get_products(
+                missing,
+                domain=self.domain,
+                days=self.days + KeepaHistoryStore.padding_days,
+            )
+        pivots = []
+        for asin in asins:
+            member = KeepaProduct(asin, domain=self.domain)
+            member.extract_from_products(products)
+            if not member.data:
+                continue
+            member.get_last_days(days=self.days)
+            if member.exists:
+                pivots.append(member.last_days)
+        if not pivots:
+            self.history = pd.DataFrame()
+            return self.history
+        history = pd.concat(pivots).reset_index()
+        history["sales avg"] = (history["sales min"] + history["sales max"]) / 2
+        history["revenue"] = history["sales avg"] * history["final price"]
+        self.history = history.merge(
+            self.themes, how="left", left_on="asin", right_index=True
+        )
+        return self.history
 
-        sales = p.get("monthlySold")
-        if not sales:
-            sales = 0
+    def _add_share(self, summary: pd.DataFrame) -> pd.DataFrame:
+        total = summary["sales avg"].sum()
+        summary["share"] = (summary["sales avg"] / total).round(4) if total else nan
+        summary[["full price", "final price"]] = summary[
+            ["full price", "final price"]
+        ].round(2)
+        summary[["BSR", "revenue"]] = summary[["BSR", "revenue"]].round(0)
+        return summary.sort_values("sales avg", ascending=False)
 
-        img_link = (
-            "https://m.media-amazon.com/images/I/" + p.get("imagesCSV").split(",")[0]
+    def summarize(self) -> pd.DataFrame:
+        """
+        Computes per-variation and per-dimension sales and prices with each
+        group's share of family sales, plus family totals.
+        """
+        if self.history is None:
+            self.pull_history()
+        if len(self.history) == 0:
+            return pd.DataFrame()
+        history = self.history
+        self.price_pivot = history.pivot_table(
+            values="final price", index="date", columns="asin", aggfunc="mean"
+        )
+        self.sales_pivot = history.pivot_table(
+            values="sales avg", index="date", columns="asin", aggfunc="sum"
         )
+        variation_summary = history.groupby("asin").agg(KeepaFamily.summary_aggfunc)
+        self.variation_summary = self._add_share(variation_summary.join(self.themes))
+        self.dimension_summary = {
+            dimension: self._add_share(
+                history.groupby(dimension).agg(KeepaFamily.summary_aggfunc)
+            )
+            for dimension in self.themes.columns
+        }
+        self.totals = history[["sales min", "sales max", "sales avg", "revenue"]].sum()
+        self.totals["final price"] = (
+            self.totals["revenue"] / self.totals["sales avg"]
+            if self.totals["sales avg"]
+            else nan
+        )
+        self.totals["variations"] = history["asin"].nunique()
+        return self.variation_summary
+
+
+def _bulk_daily_sales_worker(payload: dict, domain: str, days: int):
+    """process pool worker: builds the daily pivot for one compact payload"""
+    product = KeepaProduct(payload["asin"], domain=domain)
+    product.data = [payload]
+    product.generate_daily_sales(days=days)
+    if not product.exists:
+        return None
+    pivot = product.pivot
+    pivot.index = pd.DatetimeIndex(pd.to_datetime(pivot.index), name="date")
+    return pivot.reset_index().assign(asin=product.asin)
+
 
-        items[asin]["brand"] = brand
-        items[asin]["title"] = title
-        items[asin]["bulletpoints"] = "\n".join(bulletpoints)
-        items[asin]["description"] = description
-        items[asin]["full price"] = price
-        items[asin]["discount"] = coupon
-        items[asin]["monthly sales"] = sales
-        items[asin]["image"] = img_link
-    return items
+def bulk_daily_sales(
+    asins: list[str],
+    domain: str = "US",
+    days: int = 360,
+    workers: int | None = None,
+    batch_size: int = 100,
+) -> pd.DataFrame:
+    """
+    Generates daily pivots for a large list of ASINs across a process pool.
+    Keepa batches are fetched in this process while workers build the pivots
+    of earlier batches; workers receive compact raw-array payloads and return
+    pivots which are concatenated once in long format and compacted.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    futures = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, len(asins), batch_size):
+            products = get_products(
+                asins[start : start + batch_size],
+                domain=domain,
+                days=days + KeepaHistoryStore.padding_days,
+            )
+            futures.extend(
+                executor.submit(
+                    _bulk_daily_sales_worker, compact_payload(product), domain, days
+                )
+                for product in products
+                if product.get("data")
+            )
+        results = [x.result() for x in futures]
+    results = [x for x in results if x is not None]
+    if not results:
+        return pd.DataFrame()
+    return mm.compact_frame(pd.concat(results, ignore_index=True))
+
+
+def fit_bsr_model(history: pd.DataFrame, min_days: int = 30) -> pd.DataFrame:
+    """
+    Fits log(daily units) = intercept + slope * log(BSR) per category from the
+    days of long-format history ("asin", "category", "BSR", "sales min",
+    "sales max") that have both BSR and monthlySold-based sales.
+    Categories with fewer than min_days such days are left out.
+    """
+    sales = history[["sales min", "sales max"]].fillna(0)
+    known = (history["BSR"] > 0) & (sales.sum(axis=1) > 0)
+    if "sales estimated" in history.columns:
+        known &= ~history["sales estimated"].fillna(False).astype(bool)
+    known = history[known]
+    units = (known["sales min"].fillna(0) + known["sales max"].fillna(0)) / 2
+    x = np.log(known["BSR"].to_numpy(dtype="float64"))
+    y = np.log(units.to_numpy(dtype="float64"))
+    points = pd.DataFrame(
+        {
+            "category": known["category"].to_numpy(),
+            "x": x,
+            "y": y,
+            "xx": x * x,
+            "xy": x * y,
+            "min ratio": (known["sales min"].fillna(0) / units).to_numpy(),
+            "max ratio": (known["sales max"].fillna(0) / units).to_numpy(),
+        }
+    )
+    model = points.groupby("category").agg(
+        days=("x", "size"),
+        x=("x", "mean"),
+        y=("y", "mean"),
+        xx=("xx", "mean"),
+        xy=("xy", "mean"),
+        min_ratio=("min ratio", "mean"),
+        max_ratio=("max ratio", "mean"),
+    )
+    model = model[(model["days"] >= min_days) & (model["xx"] > model["x"] ** 2)]
+    model["slope"] = (model["xy"] - model["x"] * model["y"]) / (
+        model["xx"] - model["x"] ** 2
+    )
+    model["intercept"] = model["y"] - model["slope"] * model["x"]
+    return model[["slope", "intercept", "min_ratio", "max_ratio", "days"]]
+
+
+def estimate_sales_from_bsr(history: pd.DataFrame, model: pd.DataFrame) -> pd.DataFrame:
+    """
+    Fills "sales min"/"sales max" from BSR for ASINs that have no monthlySold-based
+    sales in the history, using the fitted per-category model.
+    Filled days are flagged in the "sales estimated" column.
+    """
+    history = history.copy()
+    estimated = (
+        history["sales estimated"].fillna(False).astype(bool)
+        if "sales estimated" in history.columns
+        else pd.Series(False, index=history.index)
+    )
+    has_sales = history[["sales min", "sales max"]].notna().any(axis=1) & ~estimated
+    bsr_only = ~has_sales.groupby(history["asin"].to_numpy()).transform("any")
+    coefficients = model.reindex(history["category"].to_numpy())
+    units = np.exp(
+        coefficients["intercept"].to_numpy()
+        + coefficients["slope"].to_numpy()
+        * np.log(history["BSR"].where(history["BSR"] > 0).to_numpy(dtype="float64"))
+    )
+    gaps = bsr_only.to_numpy() & ~np.isnan(units)
+    history.loc[gaps, "sales min"] = np.round(
+        units[gaps] * coefficients["min_ratio"].to_numpy()[gaps]
+    )
+    history.loc[gaps, "sales max"] = np.round(
+        units[gaps] * coefficients["max_ratio"].to_numpy()[gaps]
+    )
+    history["sales estimated"] = estimated.to_numpy() | gaps
+    return history
+
+
+def fill_sales_from_bsr(
+    store: KeepaHistoryStore, min_days: int = 30, write: bool = False
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Batch over the history store: fits the BSR model per root category from all
+    stored ASINs and fills sales for BSR-only ASINs. With write=True the filled
+    histories are saved back to the store. Returns the history and the model.
+    """
+    history = store.load_all()
+    if len(history) == 0:
+        return history, pd.DataFrame()
+    history = history.join(store.catalog()["category"], on="asin")
+    model = fit_bsr_model(history, min_days=min_days)
+    history = estimate_sales_from_bsr(history, model)
+    if write:
+        filled = history[history["sales estimated"]]["asin"].unique()
+        for asin in filled:
+            store.append(
+                asin,
+                history[history["asin"] == asin].drop(columns=["asin", "category"]),
+            )
+    return history, model
+
+
+# daily pivot columns -> BigQuery column names of the long-format history table
+BIGQUERY_HISTORY_COLUMNS = {
+    "full price": "full_price",
+    "% off": "percent_off",
+    "$ off": "dollar_off",
+    "SNS %": "sns_percent_off",
+    "SNS $": "sns_dollar_off",
+    "LD": "ld",
+    "final price": "final_price",
+    "sales min": "sales_min",
+    "sales max": "sales_max",
+    "BSR": "bsr",
+}
+
+
+def export_history_to_bigquery(
+    store: KeepaHistoryStore,
+    destination: str = "auxillary_development.keepa_daily_history",
+    asins: list[str] | None = None,
+) -> int:
+    """
+    Appends the stored daily pivots of all (or selected) ASINs to one long-format
+    BigQuery table partitioned by date and clustered by asin. For ASINs already in
+    the table the rows from the last loaded date on (or from the earliest day
+    estimated by fill_sales_from_bsr since) are deleted and loaded again.
+    Returns the number of rows loaded.
+    """
+    from google.cloud import bigquery
+
+    from connectors import gcloud as gc
+
+    history = store.load_all(asins)
+    if len(history) == 0:
+        return 0
+    history = history.reset_index().rename(columns=BIGQUERY_HISTORY_COLUMNS)
+    history["date"] = pd.to_datetime(history["date"])
+    if "sales estimated" in history.columns:
+        history["sales_estimated"] = history["sales estimated"].fillna(False)
+    else:
+        history["sales_estimated"] = False
+    history = history[
+        ["asin", "date", *BIGQUERY_HISTORY_COLUMNS.values(), "sales_estimated"]
+    ]
+
+    dataset, table = destination.rsplit(".", 1)
+    if table in gc.get_tables(dataset, refresh=True):
+        loaded = gc.pull_gcloud(
+            custom_query=(
+                "SELECT asin, MAX(date) AS last_date, "
+                "COUNTIF(sales_estimated) AS estimated "
+                f"FROM `{destination}` GROUP BY asin"
+            )
+        )
+    else:
+        loaded = pd.DataFrame(columns=["asin", "last_date", "estimated"])
+    loaded["last_date"] = pd.to_datetime(loaded["last_date"])
+    loaded = loaded.set_index("asin")
+
+    # the last loaded day was partial and may have been replaced since, and
+    # fill_sales_from_bsr may have estimated days that were loaded without sales:
+    # those asins are reloaded from the earliest changed day
+    history = history.join(loaded, on="asin")
+    old = history["date"] <= history["last_date"]
+    estimated = (
+        history[old & history["sales_estimated"]]
+        .groupby("asin", observed=True)["date"]
+        .agg(["min", "size"])
+    )
+    start = loaded["last_date"].copy()
+    refilled = estimated.index[
+        estimated["size"] != loaded["estimated"].reindex(estimated.index).fillna(0)
+    ]
+    start.loc[refilled] = estimated.loc[refilled, "min"]
+    history = history.join(start.rename("start"), on="asin")
+    history = history[history["start"].isnull() | (history["date"] >= history["start"])]
+    starts = history.dropna(subset="start").groupby("asin", observed=True)["start"]
+    starts = {asin: start.date() for asin, start in starts.min().items()}
+    if starts:
+        gc.delete_rows(destination, starts=("asin", "date", starts))
+    history = history.drop(columns=["last_date", "estimated", "start"])
+    if len(history) == 0:
+        return 0
+
+    gc.push_to_cloud(
+        history,
+        destination,
+        schema=[
+            bigquery.SchemaField("asin", "STRING"),
+            bigquery.SchemaField("date", "DATE"),
+            *[
+                bigquery.SchemaField(x, "FLOAT")
+                for x in BIGQUERY_HISTORY_COLUMNS.values()
+            ],
+            bigquery.SchemaField("sales_estimated", "BOOLEAN"),
+        ],
+        partition_field="date",
+        clustering_fields=["asin"],
+    )
+    return len(history)
@@ -392,3 +392,91 @@ def encrypt_string(hash_string):
 
     string_encoded = hashlib.sha256(str(hash_string).encode()).hexdigest()
     return string_encoded
+
+
+def _smallest_int_dtype(low, high, unsigned: bool = False) -> str | None:
+    """smallest (un)signed integer dtype holding the range low..high, None if none does"""
+    import numpy as np
+
+    for bits in (8, 16, 32, 64):
+        dtype = f"uint{bits}" if unsigned else f"int{bits}"
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return dtype
+    return None
+
+
+def compact_frame(
+    df: pd.DataFrame,
+    categories: bool = True,
+    category_ratio: float = 0.5,
+    floats_to_int: bool = True,
+    verbose: bool = False,
+) -> pd.DataFrame:
+    """
+    Shrinks a DataFrame's memory footprint based on the actual column values:
+    - integers get the smallest dtype of the same signedness holding their
+      min..max range
+    - floats with whole values and no NaN become integers, other floats become
+      float32 only if every value survives the float32 round trip unchanged
+    - date / datetime objects are converted to datetime64
+    - strings with few unique values become categoricals (if categories=True)
+    Bytes saved are stored in df.attrs["bytes_saved"].
+
+    Args:
+        df: frame to compact, it is not modified
+        categories: convert low-cardinality strings to categoricals; disable
+            for frames that will be assigned new string values or uploaded
+        category_ratio: max share of unique values for a string column to
+            become a categorical
+        floats_to_int: allow whole-valued float columns to become integers;
+            disable to keep column types stable, e.g. for existing tables
+        verbose: print the bytes saved
+    """
+    import numpy as np
+
+    before = int(df.memory_usage(deep=True).sum())
+    df = df.copy()
+    for col in df.columns:
+        series = df[col]
+        dtype = series.dtype
+        if pd.api.types.is_bool_dtype(dtype) or len(series) == 0:
+            continue
+        if pd.api.types.is_integer_dtype(dtype) and isinstance(dtype, np.dtype):
+            target = _smallest_int_dtype(
+                series.min(), series.max(), unsigned=dtype.kind == "u"
+            )
+            if target and np.dtype(target).itemsize < dtype.itemsize:
+                df[col] = series.astype(target)
+        elif pd.api.types.is_float_dtype(dtype) and dtype.itemsize > 4:
+            values = series.to_numpy()
+            finite = values[np.isfinite(values)]
+            if len(finite) == 0:
+                df[col] = series.astype("float32")
+                continue
+            whole = bool((finite == np.round(finite)).all())
+            target = _smallest_int_dtype(finite.min(), finite.max())
+            if whole and floats_to_int and len(finite) == len(values) and target:
+                df[col] = series.astype(target)
+            elif np.array_equal(finite.astype("float32").astype(values.dtype), finite):
+                df[col] = series.astype("float32")
+        elif dtype == object or isinstance(dtype, pd.StringDtype):
+            kind = pd.api.types.infer_dtype(series, skipna=True)
+            if kind in ("date", "datetime", "datetime64"):
+                try:
+                    df[col] = pd.to_datetime(series)
+                except (ValueError, TypeError):
+                    pass
+            elif (
+                categories
+                and kind == "string"
+                and series.nunique() <= category_ratio * len(series)
+            ):
+                df[col] = series.astype("category")
+    df.attrs["bytes_saved"] = before - int(df.memory_usage(deep=True).sum())
+    if verbose:
+        print(
+            f"compact_frame: {before:,} -> {before - df.attrs['bytes_saved']:,} bytes, "
+            f"saved {df.attrs['bytes_saved']:,}"
+        )
+    return df
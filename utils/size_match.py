@@ -66,7 +66,8 @@ def get_dims_file(
     folder_id="1zIHmbWcRRVyCTtuB9Atzam7IhAs8Ymx4", filename="DIMENSIONS.xlsx"
 ):
     file = pd.read_excel(
-        gd.download_file(gd.find_file_id(folder_id, drive_id, filename)), skiprows=1
+        gd.download_file(gd.find_file_id(folder_id, drive_id, filename), spool=True),
+        skiprows=1,
     )
     del file["Product Name"]
     file.columns = [x.lower() for x in file.columns]